@@ -1,12 +1,18 @@
 from analysis3dGUI import Contrast3dAnalysisGUI
 import os
+import time
 import utils as ut
+import chunkedStore as cs
+import lazyVolume as lv
+import volumePyramid as vp
+import sliceRenderer as sr
+import loadWorker as lw
 import lognormalFunctions as lf
 from itertools import chain
 import platform
 from ticEditor import TICEditorGUI
 import scipy.interpolate as interpolate
-from PyQt5.QtCore import Qt, QLine
+from PyQt5.QtCore import Qt, QLine, QTimer
 from PyQt5.QtGui import QPixmap, QImage, QPainter, QBitmap, QColor
 import matplotlib.pyplot as plt
 import numpy as np
@@ -18,7 +24,6 @@ from PyQt5.QtWidgets import QFileDialog
 import shutil
 # from scipy.io import loadmat
 from scipy.signal import hilbert
-from mat73 import loadmat
 
 
 # When running for testing, use the below code to silence invalid value in log warning.
@@ -45,6 +50,40 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
         self.convertXmlReady = False
         self.calculateParamapButton.setHidden(True)
 
+        self.liveWatcher = None
+        self.liveTimer = QTimer(self)
+        self.liveTimer.timeout.connect(self.pollAcquisition)
+        self.watchFolderButton.setCheckable(True)
+        self.watchFolderButton.clicked.connect(self.toggleLiveAcquisition)
+
+        self.loadWorker = None
+        self.retiredWorkers = set() # cancelled workers whose threads are still running
+        self.pyramid = None
+        self.renderCache = sr.RenderCache()
+        self.maskVersion = 0
+        self.shownKeys = {} # plane -> render key of what its label shows
+        self.paramapLabels = {} # parameter -> label volume of its quantized values
+
+        # crosshair moves only mark planes dirty; the timer draws them at most once per display frame
+        self.dirtyPlanes = set()
+        self.lastCrosshair = None
+        self.refreshTimer = QTimer(self)
+        self.refreshTimer.setSingleShot(True)
+        self.refreshTimer.setInterval(16)
+        self.refreshTimer.timeout.connect(self.refreshPlanes)
+
+        # cine playback: each tick shows the frame due at that moment, so a
+        # slow step drops frames instead of slowing the clip down
+        self.prefetcher = None
+        self.cineTimer = QTimer(self)
+        self.cineTimer.setTimerType(Qt.PreciseTimer)
+        self.cineTimer.timeout.connect(self.cineStep)
+        self.cinePlayButton.setCheckable(True)
+        self.cinePlayButton.clicked.connect(self.toggleCine)
+        self.cineFps.valueChanged.connect(self.cineRateChanged)
+        self.slicesChanger.sliderPressed.connect(self.stopCine)
+        self.cancelLoadButton.clicked.connect(self.cancelLoad)
+
 
     # FIRST STEP: get the input text of the nifti input line edit
 #-------------------------------------------------------------------------------------------------------------
@@ -52,7 +91,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
     # if file path is entered, check that it exists and get it, otherwise, let user
     # browse themselves for a valid nifti file; also makes directories to store drawings and masks made
     def getTextInput(self) :
-        fileName, _ = QFileDialog.getOpenFileName(None, 'Open File', filter = '*.nii *.nii.gz *.mat')
+        fileName, _ = QFileDialog.getOpenFileName(None, 'Open File', filter = '*.nii *.nii.gz *.npz *.mat *.xml')
         # fileName = QFileDialog.getExistingDirectory(None, 'Select Directory')
         if fileName != '':
             self.niftiLineEdit.setText(fileName)
@@ -84,6 +123,9 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                 self.convertXmlReady = True
 
     def clearInputBrowsing(self):
+        if self.watchFolderButton.isChecked():
+            self.watchFolderButton.setChecked(False)
+            self.toggleLiveAcquisition()
         self.xmlLineEdit.setText("")
         self.inputXmlFileLocation = ""
         if self.convertXmlReady:
@@ -139,43 +181,46 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
 
 
 
-        if self.inputTextPath.endswith(".mat"):
-            input = loadmat(self.inputTextPath)
-            self.dataNibImg = []
-            rf_data_all_fund = input["rf_data_all_fund"]
-            for i in range(2):
-                for j in range(5):
-                    temp = rf_data_all_fund[i][j]
-                    other_temp = temp
-                    for k in range(temp.shape[1]):
-                        other_temp[:,k] = 20*np.log10(abs(hilbert(temp[:,k])))
-                    self.dataNibImg.append(other_temp)
-            # self.dataNibImg = 20*np.log10(abs(hilbert(input["rf_data_all_fund"])))
-
-            self.dataNibImg = np.array(self.dataNibImg)
-            self.dataNibImg = np.reshape(self.dataNibImg, (self.dataNibImg.shape[0], self.dataNibImg.shape[1], self.dataNibImg.shape[2], 1))
-
-
-        else:
-            self.nibImg = nib.load(self.inputTextPath, mmap=False)
-            self.dataNibImg = self.nibImg.get_fdata()
-            self.dataNibImg = self.dataNibImg.astype(np.uint8)
+        if os.path.isdir(self.inputTextPath):
+            # live acquisition: the volume keeps growing while it is displayed
+            self.showStudy((self.liveWatcher.volume, self.liveWatcher.volume))
+            return
+        # read on a worker thread (see lw.open_study); the study on screen
+        # stays usable until the new one is open
+        path = self.inputTextPath
+        self.startLoadWorker(lw.TaskWorker(lambda progress: lw.open_study(path, progress), lw.close_study), self.showStudy)
+
+    def showStudy(self, study):
+        # (nibImg, dataNibImg) from lw.open_study; nibImg is None for .mat
+        self.closeStudy()
+        nibImg, self.dataNibImg = study
+        if nibImg is not None:
+            self.nibImg = nibImg
             self.windowsComputed = False
 
-
-        self.OGData4dImg = self.dataNibImg.copy()
+        if isinstance(self.dataNibImg, (cs.ChunkedVolume, lv.FrameVolume4D)) or not self.dataNibImg.flags.writeable:
+            self.OGData4dImg = self.dataNibImg # read-only, nothing to protect
+        else:
+            self.OGData4dImg = self.dataNibImg.copy()
 
         # self.header = self.nibImg.header['pixdim']
         # print(self.header)
 
+        self.stopCine()
         self.data4dImg = self.dataNibImg
         self.x, self.y, self.z, self.numSlices = self.data4dImg.shape
-        self.maskCoverImg = np.zeros([self.x, self.y, self.z,4])
+        self.pyramid = vp.VolumePyramid(self.data4dImg, (331, 311)) # 2x/4x levels for the small views, built in the background
+        self.planes = sr.PlaneRenderer(self.pyramid) # display-ordered planes, zero-copy while the crosshair moves
+        self.renderCache.clear()
+        self.maskCoverImg = sr.label_volume([self.x, self.y, self.z]) # ROI points drawn on each voxel, see sr.paint_labels
+        self.paramapLabels = {}
+        self.setOverlay(self.maskCoverImg, sr.ROI_COLORS)
         self.slicesChanger.setMaximum(self.numSlices-1)
         self.curSlices.setText(str(self.curSlice+1))
         self.totalSlices.setText(str(self.numSlices))
         self.slicesChanger.valueChanged.connect(self.sliceValueChanged)
         self.slicesChanger.setDisabled(False)
+        self.cinePlayButton.setDisabled(False)
 
         self.x -= 1
         self.y -= 1
@@ -191,21 +236,11 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
         self.currentFrameSag.setText("1")
         self.currentFrameCor.setText("1")
 
-        tempAx = self.maskCoverImg[:,:,0,:] #2D data for axial
-        tempAx = np.flipud(tempAx) #flipud
-        tempAx = np.rot90(tempAx,3) #rotate ccw 270
-        tempAx = np.require(tempAx,np.uint8, 'C')
+        tempAx = sr.argb_plane(self.overlayLabels, self.overlayLut, 2, 0) #2D data for axial, in display order
 
-        tempSag = self.maskCoverImg[0,:,:,:] #2D data for sagittal
-        tempSag = np.flipud(tempSag) #flipud
-        tempSag = np.rot90(tempSag,2) #rotate ccw 180
-        tempSag = np.fliplr(tempSag)
-        tempSag = np.require(tempSag,np.uint8,'C')
+        tempSag = sr.argb_plane(self.overlayLabels, self.overlayLut, 0, 0) #2D data for sagittal, in display order
 
-        tempCor = self.maskCoverImg[:,0,:,:] #2D data for coronal
-        tempCor = np.rot90(tempCor,1) #rotate ccw 90
-        tempCor = np.flipud(tempCor) #flipud
-        tempCor = np.require(tempCor,np.uint8,'C')
+        tempCor = sr.argb_plane(self.overlayLabels, self.overlayLut, 1, 0) #2D data for coronal, in display order
 
         self.maskAxH, self.maskAxW = tempAx[:,:,0].shape #getting height and width for each plane
         self.maskSagH, self.maskSagW = tempSag[:,:,0].shape
@@ -244,21 +279,9 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
         self.drawPolygonButton.setCheckable(True)
 
         #getting initial image data for axial, sag, coronal slices
-        self.data2dAx = self.data4dImg[:,:,0, self.curSlice] #2D data for axial
-        self.data2dAx = np.flipud(self.data2dAx) #flipud
-        self.data2dAx = np.rot90(self.data2dAx,3) #rotate ccw 270
-        self.data2dAx = np.require(self.data2dAx,np.uint8, 'C')
-
-        self.data2dSag = self.data4dImg[0,:,:, self.curSlice] #2D data for sagittal
-        self.data2dSag = np.flipud(self.data2dSag) #flipud
-        self.data2dSag = np.rot90(self.data2dSag,2) #rotate ccw 180
-        self.data2dSag = np.fliplr(self.data2dSag)
-        self.data2dSag = np.require(self.data2dSag,np.uint8,'C')
-
-        self.data2dCor = self.data4dImg[:,0,:, self.curSlice] #2D data for coronal
-        self.data2dCor = np.rot90(self.data2dCor,1) #rotate ccw 90
-        self.data2dCor = np.flipud(self.data2dCor) #flipud
-        self.data2dCor = np.require(self.data2dCor,np.uint8,'C')
+        self.data2dAx = np.require(sr.orient_plane(self.data4dImg[:,:,0, self.curSlice], 2), np.uint8, 'C') #2D data for axial, in display order
+        self.data2dSag = np.require(sr.orient_plane(self.data4dImg[0,:,:, self.curSlice], 0), np.uint8, 'C') #2D data for sagittal
+        self.data2dCor = np.require(sr.orient_plane(self.data4dImg[:,0,:, self.curSlice], 1), np.uint8, 'C') #2D data for coronal
 
         self.heightAx, self.widthAx = self.data2dAx.shape #getting height and width for each plane
         self.heightSag, self.widthSag = self.data2dSag.shape
@@ -319,14 +342,17 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
     def sliceValueChanged(self):
         self.curSlice = int(self.sliceArray[self.slicesChanger.value()])
         self.curSlices.setText(str(self.curSlice+1))
+        if isinstance(self.data4dImg, lv.FrameCache4D):
+            self.data4dImg.prefetch(self.curSlice)
+        self.pyramid.set_focus(self.curSlice)
         self.changeAxialSlices()
         self.changeSagSlices()
         self.changeCorSlices()
 
     def alphaValueChanged(self):
         self.alphaTracker.setValue(int(self.curAlpha.value()))
-        for i in range(len(self.pointsPlotted)):
-            self.maskCoverImg[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2],3] = int(self.curAlpha.value())
+        self.overlayLut = sr.overlay_lut(self.overlayColors, int(self.curAlpha.value()))
+        self.maskChanged()
         self.changeAxialSlices()
         self.changeSagSlices()
         self.changeCorSlices()
@@ -347,27 +373,10 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
 
         self.currentFrameAx.setText(str(self.newZVal+1))
 
-        self.data2dAx = self.data4dImg[:,:,self.newZVal, self.curSlice]#, self.curSlice] #defining 2D data for axial
-        self.data2dAx = np.flipud(self.data2dAx) #flipud
-        self.data2dAx = np.rot90(self.data2dAx,3) #rotate
-        self.data2dAx = np.require(self.data2dAx,np.uint8,'C')
-
-        self.bytesLineAx, _ = self.data2dAx.strides
-        self.qImgAx = QImage(self.data2dAx,self.widthAx, self.heightAx, self.bytesLineAx, QImage.Format_Grayscale8)
-
-        tempAx = self.maskCoverImg[:,:,self.newZVal,:] #2D data for axial
-        tempAx = np.flipud(tempAx) #flipud
-        tempAx = np.rot90(tempAx,3) #rotate ccw 270
-        tempAx = np.require(tempAx,np.uint8, 'C')
-
-        self.curMaskAxIm = QImage(tempAx, self.maskAxW, self.maskAxH, self.maskBytesLineAx, QImage.Format_ARGB32) #creating QImage
-
-        if self.id == 0:
-            self.maskLayerAx.setPixmap(QPixmap.fromImage(self.curMaskAxIm).scaled(331,311)) #displaying QPixmap in the QLabels
-            self.axialPlane.setPixmap(QPixmap.fromImage(self.qImgAx).scaled(331,311)) #otherwise, would just display the normal unmodified q_img
-        elif self.id == 1:
-            self.maskLayerAx.setPixmap(QPixmap.fromImage(self.curMaskAxIm).scaled(680, 638))
-            self.axialPlane.setPixmap(QPixmap.fromImage(self.qImgAx).scaled(680,638)) #otherwise, would just display the normal unmodified q_img
+        if self.id == 0 or self.id == 1:
+            maskPixmap, imagePixmap = self.renderPlane(2, self.newZVal, self.id == 1)
+            self.maskLayerAx.setPixmap(maskPixmap) #displaying QPixmap in the QLabels
+            self.axialPlane.setPixmap(imagePixmap)
 
 
     def changeSagSlices(self):
@@ -382,29 +391,10 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
 
         self.currentFrameSag.setText(str(self.newXVal+1))
 
-        self.data2dSag = self.data4dImg[self.newXVal,:,:, self.curSlice]#, self.curSlice]
-        self.data2dSag = np.flipud(self.data2dSag) #flipud
-        self.data2dSag = np.rot90(self.data2dSag,2) #rotate
-        self.data2dSag = np.fliplr(self.data2dSag)
-        self.data2dSag = np.require(self.data2dSag,np.uint8,'C')
-
-        self.bytesLineSag, _ = self.data2dSag.strides
-        self.qImgSag = QImage(self.data2dSag,self.widthSag, self.heightSag, self.bytesLineSag, QImage.Format_Grayscale8)
-
-        tempSag = self.maskCoverImg[self.newXVal,:,:,:] #2D data for sagittal
-        tempSag = np.flipud(tempSag) #flipud
-        tempSag = np.rot90(tempSag,2) #rotate ccw 180
-        tempSag = np.fliplr(tempSag)
-        tempSag = np.require(tempSag,np.uint8,'C')
-        
-        self.curMaskSagIm = QImage(tempSag, self.maskSagW, self.maskSagH, self.maskBytesLineSag, QImage.Format_ARGB32)
-
-        if self.id == 0:
-            self.maskLayerSag.setPixmap(QPixmap.fromImage(self.curMaskSagIm).scaled(331,311))
-            self.sagPlane.setPixmap(QPixmap.fromImage(self.qImgSag).scaled(331,311))
-        elif self.id == 2:
-            self.maskLayerSag.setPixmap(QPixmap.fromImage(self.curMaskSagIm).scaled(680, 638))
-            self.sagPlane.setPixmap(QPixmap.fromImage(self.qImgSag).scaled(680,638))
+        if self.id == 0 or self.id == 2:
+            maskPixmap, imagePixmap = self.renderPlane(0, self.newXVal, self.id == 2)
+            self.maskLayerSag.setPixmap(maskPixmap)
+            self.sagPlane.setPixmap(imagePixmap)
 
 
     def changeCorSlices(self):
@@ -419,28 +409,131 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
 
         self.currentFrameCor.setText(str(self.newYVal+1))
 
-        self.data2dCor = self.data4dImg[:,self.newYVal,:, self.curSlice]#, self.curSlice]
-        self.data2dCor = np.rot90(self.data2dCor,1) #rotate
-        self.data2dCor = np.flipud(self.data2dCor) #flipud
-        self.data2dCor = np.require(self.data2dCor, np.uint8,'C')
-
-        self.bytesLineCor, _ = self.data2dCor.strides
-        self.qImgCor = QImage(self.data2dCor,self.widthCor,self.heightCor, self.bytesLineCor, QImage.Format_Grayscale8)
-
-        tempCor = self.maskCoverImg[:,self.newYVal,:,:] #2D data for coronal
-        tempCor = np.rot90(tempCor,1) #rotate ccw 90
-        tempCor = np.flipud(tempCor) #flipud
-        tempCor = np.require(tempCor,np.uint8,'C')
-
-        self.curMaskCorIm = QImage(tempCor, self.maskCorW, self.maskCorH, self.maskBytesLineCor, QImage.Format_ARGB32)
-
-        if self.id == 0:
-            self.maskLayerCor.setPixmap(QPixmap.fromImage(self.curMaskCorIm).scaled(331,311))
-            self.corPlane.setPixmap(QPixmap.fromImage(self.qImgCor).scaled(331,311))
-
-        elif self.id == 3:
-            self.maskLayerCor.setPixmap(QPixmap.fromImage(self.curMaskCorIm).scaled(680, 638))
-            self.corPlane.setPixmap(QPixmap.fromImage(self.qImgCor).scaled(680,638))
+        if self.id == 0 or self.id == 3:
+            maskPixmap, imagePixmap = self.renderPlane(1, self.newYVal, self.id == 3)
+            self.maskLayerCor.setPixmap(maskPixmap)
+            self.corPlane.setPixmap(imagePixmap)
+
+    def renderPlane(self, axis, index, expanded):
+        # Scaled (mask, image) pixmaps of one plane of the current frame. A
+        # view shown before (same plane, slice, frame, zoom and overlay) is a
+        # cache hit; otherwise the image plane comes from the pyramid level for
+        # the label size, full resolution only for the expanded view
+        size = (680, 638) if expanded else (331, 311)
+        key = (axis, index, self.curSlice, expanded, self.maskVersion)
+        self.shownKeys[axis] = key
+        pixmaps = self.renderCache.get(key)
+        if pixmaps is None:
+            if self.prefetcher is not None:
+                data2d = self.prefetcher.take(self.curSlice, axis, index, size)
+                if data2d is None:
+                    data2d = self.planes.cut(axis, index, self.curSlice, size) # a layout build would stall playback
+            else:
+                data2d = self.planes.plane(axis, index, self.curSlice, size)
+            qImg = QImage(data2d, data2d.shape[1], data2d.shape[0], data2d.strides[0], QImage.Format_Grayscale8)
+            temp = sr.argb_plane(self.overlayLabels, self.overlayLut, axis, index) # coloured here, one plane at a time
+            maskImg = QImage(temp, temp.shape[1], temp.shape[0], temp.strides[0], QImage.Format_ARGB32)
+            pixmaps = (QPixmap.fromImage(maskImg).scaled(*size), QPixmap.fromImage(qImg).scaled(*size))
+            self.renderCache.put(key, pixmaps, 2*4*size[0]*size[1])
+        return pixmaps
+
+    def shownViews(self):
+        # (axis, index, display size) of every plane on screen
+        if self.id == 1:
+            return [(2, self.newZVal, (680, 638))]
+        if self.id == 2:
+            return [(0, self.newXVal, (680, 638))]
+        if self.id == 3:
+            return [(1, self.newYVal, (680, 638))]
+        return [(2, self.newZVal, (331, 311)), (0, self.newXVal, (331, 311)), (1, self.newYVal, (331, 311))]
+
+    def toggleCine(self):
+        if not self.cinePlayButton.isChecked():
+            self.stopCine()
+            return
+        self.prefetcher = sr.PlanePrefetcher(self.planes)
+        self.cinePlayButton.setText("Pause")
+        self.cineRateChanged()
+
+    def cineRateChanged(self):
+        # the playback clock restarts at the frame on screen
+        self.cineStart = time.monotonic()
+        self.cineStartValue = self.slicesChanger.value()
+        self.cineLastStep = self.cineStart
+        self.cineTimer.setInterval(int(1000/self.cineFps.value()))
+        if self.cinePlayButton.isChecked():
+            self.cineTimer.start()
+
+    def stopCine(self):
+        self.cineTimer.stop()
+        self.cinePlayButton.setChecked(False)
+        self.cinePlayButton.setText("Play")
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def cineStep(self):
+        now = time.monotonic()
+        numFrames = self.slicesChanger.maximum()+1
+        value = (self.cineStartValue + int((now-self.cineStart)*self.cineFps.value())) % numFrames
+        # frames between the last step and this one are dropped, and the
+        # prefetcher works at the stride steps are actually taking
+        stride = max(1, round((now-self.cineLastStep)*self.cineFps.value()))
+        self.cineLastStep = now
+        if value != self.slicesChanger.value():
+            self.slicesChanger.setValue(value) # renders through sliceValueChanged
+        upcoming = [int(self.sliceArray[(value + stride*k) % numFrames]) for k in range(1, sr.CINE_AHEAD+1)]
+        self.prefetcher.set_wanted(upcoming, self.shownViews())
+
+    def markDirty(self, *planes):
+        # planes are axes: 0 sagittal, 1 coronal, 2 axial
+        self.dirtyPlanes.update(planes)
+        if not self.refreshTimer.isActive():
+            self.refreshTimer.start()
+
+    def refreshPlanes(self):
+        # Every mouse event between two refreshes only moved the crosshair, so
+        # each dirty plane is drawn once, at its latest position, and a plane
+        # whose label already shows that view is not drawn at all
+        dirty = self.dirtyPlanes
+        self.dirtyPlanes = set()
+        if 2 in dirty and self.shownKeys.get(2) != (2, self.newZVal, self.curSlice, self.id == 1, self.maskVersion):
+            self.changeAxialSlices()
+        if 0 in dirty and self.shownKeys.get(0) != (0, self.newXVal, self.curSlice, self.id == 2, self.maskVersion):
+            self.changeSagSlices()
+        if 1 in dirty and self.shownKeys.get(1) != (1, self.newYVal, self.curSlice, self.id == 3, self.maskVersion):
+            self.changeCorSlices()
+        # the crosshairs were painted into the cover pixmaps
+        self.axCoverLabel.update()
+        self.sagCoverLabel.update()
+        self.corCoverLabel.update()
+
+    def setOverlay(self, labels, colors):
+        # the mask layers show labels in colors (B, G, R per label) at the current alpha
+        self.overlayLabels = labels
+        self.overlayColors = colors
+        self.overlayLut = sr.overlay_lut(colors, int(self.curAlpha.value()))
+
+    def paramapOverlay(self, param, minVal, maxVal):
+        # label volume of one parametric map over the VOI, quantized for a
+        # colormap the first time it is shown; after that showing it only
+        # swaps the lookup table
+        labels = self.paramapLabels.get(param)
+        if labels is None:
+            points = tuple(np.array(self.pointsPlotted).T)
+            labels = sr.label_volume(self.maskCoverImg.shape)
+            # ut.paramap returns an object array of [auc, pe, tp, mtt] lists,
+            # None where no window was fitted
+            values = [np.nan if v is None else v[param] for v in self.masterParamap[points]]
+            labels[points] = sr.quantize_labels(values, minVal, maxVal)
+            self.paramapLabels[param] = labels
+        return labels
+
+    def maskChanged(self):
+        # every change to the overlay (labels or lookup table) ends here:
+        # renders of the old overlay can never be shown again
+        self.maskVersion += 1
+        self.renderCache.clear()
 
 
 # FIFTH STEP: if want to enlarge images of certain cut, can do so
@@ -461,6 +554,9 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.curSlices.setHidden(True)
             self.totalSlices.setHidden(True)
             self.slicesChanger.setHidden(True)
+            self.stopCine()
+            self.cinePlayButton.setHidden(True)
+            self.cineFps.setHidden(True)
             self.legend.setHidden(True)
             self.slicesLabel.setHidden(True)
             self.alphaLabel.setHidden(True)
@@ -471,12 +567,6 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.axCoverLabel.resize(680, 638)
             self.maskLayerAx.move(470, 30)
             self.maskLayerAx.resize(680, 638)
-            tempAx = self.maskCoverImg[:,:,self.newZVal,:] #2D data for axial
-            tempAx = np.flipud(tempAx) #flipud
-            tempAx = np.rot90(tempAx,3) #rotate ccw 270
-            tempAx = np.require(tempAx,np.uint8, 'C')
-            self.curMaskAxIm = QImage(tempAx, self.maskAxW, self.maskAxH, self.maskBytesLineAx, QImage.Format_ARGB32) #creating QImage
-            self.maskLayerAx.setPixmap(QPixmap.fromImage(self.curMaskAxIm).scaled(680,638)) #displaying QPixmap in the QLabels
             self.maskLayerSag.setHidden(True)
             self.maskLayerCor.setHidden(True)
             self.axCoverPixmap = QPixmap(680, 638)
@@ -512,15 +602,9 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.ofTextAx.move(1060, 680)
             self.totalFramesAx.move(1075, 680)
 
-            self.axialPlane.setPixmap(QPixmap.fromImage(self.qImgAx).scaled(680,638))
-
-            tempAx = self.maskCoverImg[:,:,self.newZVal,:] #2D data for axial
-            tempAx = np.flipud(tempAx) #flipud
-            tempAx = np.rot90(tempAx,3) #rotate ccw 270  
-            tempAx = np.require(tempAx,np.uint8, 'C')
-
-            self.curMaskAxIm = QImage(tempAx, self.maskAxW, self.maskAxH, self.maskBytesLineAx, QImage.Format_ARGB32) #creating QImage
-            self.maskLayerAx.setPixmap(QPixmap.fromImage(self.curMaskAxIm).scaled(680,638)) #displaying QPixmap in the QLabels
+            maskPixmap, imagePixmap = self.renderPlane(2, self.newZVal, True)
+            self.axialPlane.setPixmap(imagePixmap)
+            self.maskLayerAx.setPixmap(maskPixmap) #displaying QPixmap in the QLabels
             self.axCoverLabel.pixmap().fill(Qt.transparent)
             painter = QPainter(self.axCoverLabel.pixmap())
             painter.setPen(Qt.yellow)
@@ -545,6 +629,9 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.curSlices.setHidden(True)
             self.totalSlices.setHidden(True)
             self.slicesChanger.setHidden(True)
+            self.stopCine()
+            self.cinePlayButton.setHidden(True)
+            self.cineFps.setHidden(True)
             self.slicesLabel.setHidden(True)
             self.alphaLabel.setHidden(True)
             self.slicesOf.setHidden(True)
@@ -588,7 +675,8 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.ofTextSag.move(1060,680)
             self.totalFramesSag.move(1075,680)
 
-            self.sagPlane.setPixmap(QPixmap.fromImage(self.qImgSag).scaled(680,638)) #otherwise, would just display the normal unmodified q_img
+            maskPixmap, imagePixmap = self.renderPlane(0, self.newXVal, True)
+            self.sagPlane.setPixmap(imagePixmap)
 
             self.sagCoverLabel.pixmap().fill(Qt.transparent)
             painter = QPainter(self.sagCoverLabel.pixmap())
@@ -598,14 +686,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             painter.drawLines([sagVertLine, sagLatLine])
             painter.end()
             
-            tempSag = self.maskCoverImg[self.newXVal,:,:,:] #2D data for sagittal
-            tempSag = np.flipud(tempSag) #flipud
-            tempSag = np.rot90(tempSag,2) #rotate ccw 180
-            tempSag = np.fliplr(tempSag)
-            tempSag = np.require(tempSag,np.uint8,'C')
-
-            self.curMaskSagIm = QImage(tempSag, self.widthSag, self.heightSag, self.maskBytesLineSag, QImage.Format_ARGB32)
-            self.maskLayerSag.setPixmap(QPixmap.fromImage(self.curMaskSagIm).scaled(680, 638))
+            self.maskLayerSag.setPixmap(maskPixmap)
        
 
     def enlargeCorImg(self):
@@ -624,6 +705,9 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.curSlices.setHidden(True)
             self.totalSlices.setHidden(True)
             self.slicesChanger.setHidden(True)
+            self.stopCine()
+            self.cinePlayButton.setHidden(True)
+            self.cineFps.setHidden(True)
             self.slicesLabel.setHidden(True)
             self.alphaLabel.setHidden(True)
             self.slicesOf.setHidden(True)
@@ -667,15 +751,9 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.ofTextCor.move(1060,680)
             self.totalFramesCor.move(1075,680)
 
-            self.corPlane.setPixmap(QPixmap.fromImage(self.qImgCor).scaled(680,638)) #otherwise, would just display the normal unmodified q_img
-
-            tempCor = self.maskCoverImg[:,self.newYVal,:,:] #2D data for coronal
-            tempCor = np.rot90(tempCor,1) #rotate ccw 90
-            tempCor = np.flipud(tempCor) #flipud
-            tempCor = np.require(tempCor,np.uint8,'C')
-
-            self.curMaskCorIm = QImage(tempCor, self.maskCorW, self.maskCorH, self.maskBytesLineCor, QImage.Format_ARGB32)
-            self.maskLayerCor.setPixmap(QPixmap.fromImage(self.curMaskCorIm).scaled(680,638))
+            maskPixmap, imagePixmap = self.renderPlane(1, self.newYVal, True)
+            self.corPlane.setPixmap(imagePixmap)
+            self.maskLayerCor.setPixmap(maskPixmap)
 
             self.corCoverLabel.pixmap().fill(Qt.transparent)
             painter = QPainter(self.corCoverLabel.pixmap())
@@ -703,12 +781,6 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                 self.maskLayerCor.setHidden(False)
                 self.maskLayerAx.move(470, 30)
                 self.maskLayerAx.resize(331, 311)
-                tempAx = self.maskCoverImg[:,:,self.newZVal,:] #2D data for axial
-                tempAx = np.flipud(tempAx) #flipud
-                tempAx = np.rot90(tempAx,3) #rotate ccw 270  
-                tempAx = np.require(tempAx,np.uint8, 'C')
-                self.curMaskAxIm = QImage(tempAx, self.maskAxW, self.maskAxH, self.maskBytesLineAx, QImage.Format_ARGB32) #creating QImage
-                self.maskLayerAx.setPixmap(QPixmap.fromImage(self.curMaskAxIm).scaled(331,311)) #displaying QPixmap in the QLabels
             elif self.id == 2:
                 self.sagCoverLabel.move(820, 30)
                 self.sagCoverLabel.resize(331, 311)
@@ -721,13 +793,6 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                 self.maskLayerCor.setHidden(False)
                 self.maskLayerSag.move(820, 30)
                 self.maskLayerSag.resize(331, 311)
-                tempSag = self.maskCoverImg[self.newXVal,:,:,:] #2D data for sagittal
-                tempSag = np.flipud(tempSag) #flipud
-                tempSag = np.rot90(tempSag,2) #rotate ccw 180
-                tempSag = np.fliplr(tempSag)
-                tempSag = np.require(tempSag,np.uint8,'C')
-                self.curMaskSagIm = QImage(tempSag, self.widthSag, self.heightSag, self.maskBytesLineSag, QImage.Format_ARGB32)
-                self.maskLayerSag.setPixmap(QPixmap.fromImage(self.curMaskSagIm).scaled(331, 311))
             elif self.id == 3:
                 self.corCoverLabel.move(820, 390)
                 self.corCoverLabel.resize(331, 311)
@@ -738,12 +803,6 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                 self.maskLayerSag.setHidden(False)
                 self.maskLayerCor.move(820, 390)
                 self.maskLayerCor.resize(331, 311)
-                tempCor = self.maskCoverImg[:,self.newYVal,:,:] #2D data for coronal
-                tempCor = np.rot90(tempCor,1) #rotate ccw 90
-                tempCor = np.flipud(tempCor) #flipud
-                tempCor = np.require(tempCor,np.uint8,'C')
-                self.curMaskCorIm = QImage(tempCor, self.maskCorW, self.maskCorH, self.maskBytesLineCor, QImage.Format_ARGB32)
-                self.maskLayerCor.setPixmap(QPixmap.fromImage(self.curMaskCorIm).scaled(331,311))
             self.id = 0
 
             self.axCoverLabel.pixmap().fill(Qt.transparent)
@@ -767,7 +826,6 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             corLatLine = QLine(0, int(self.newZVal/self.z*311), 331, int(self.newZVal/self.z*311))
             painter.drawLines([corVertLine, corLatLine])
             painter.end()
-            self.update()
 
             if self.aucParamapButton.isChecked() or self.peParamapButton.isChecked() or self.tpParamapButton.isChecked() or self.mttParamapButton.isChecked():
                 self.legend.setHidden(False)
@@ -795,6 +853,8 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.curSlices.setHidden(False)
             self.totalSlices.setHidden(False)
             self.slicesChanger.setHidden(False)
+            self.cinePlayButton.setHidden(False)
+            self.cineFps.setHidden(False)
             self.slicesLabel.setHidden(False)
             self.alphaLabel.setHidden(False)
             self.slicesOf.setHidden(False)
@@ -847,9 +907,16 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             # self.save_seg_Sag.setHidden(False)
             # self.save_seg_Cor.setHidden(False)
 
-            self.axialPlane.setPixmap(QPixmap.fromImage(self.qImgAx).scaled(331,311)) #otherwise, would just display the normal unmodified q_img
-            self.sagPlane.setPixmap(QPixmap.fromImage(self.qImgSag).scaled(331,311)) #otherwise, would just display the normal unmodified q_img
-            self.corPlane.setPixmap(QPixmap.fromImage(self.qImgCor).scaled(331,311)) #otherwise, would just display the normal unmodified q_img
+            #all three planes back at 331x311; planes shown before the expansion are cache hits
+            maskPixmap, imagePixmap = self.renderPlane(2, self.newZVal, False)
+            self.maskLayerAx.setPixmap(maskPixmap)
+            self.axialPlane.setPixmap(imagePixmap)
+            maskPixmap, imagePixmap = self.renderPlane(0, self.newXVal, False)
+            self.maskLayerSag.setPixmap(maskPixmap)
+            self.sagPlane.setPixmap(imagePixmap)
+            maskPixmap, imagePixmap = self.renderPlane(1, self.newYVal, False)
+            self.maskLayerCor.setPixmap(maskPixmap)
+            self.corPlane.setPixmap(imagePixmap)
 
 
 
@@ -857,6 +924,12 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
 #---------------------------------------------------------------------------------------------------------------------------------------------------------------
 #---------------------------------------------------------------------------------------------------------------------------------------------------------------
     def paintEvent(self,event):
+        # Repaints Qt asks for on its own (and the ones redrawing the labels
+        # cause) find the crosshair where it was and have nothing to do
+        crosshair = (self.xCur, self.yCur, self.id, self.scrolling, self.painted)
+        if crosshair == self.lastCrosshair:
+            return
+        self.lastCrosshair = crosshair
         scrolling = "none"
         if self.id ==0 and self.scrolling:
             if self.xCur < 811 and self.xCur > 478 and self.yCur < 342 and self.yCur > 29 and (self.painted == "none" or self.painted == "ax"):
@@ -932,8 +1005,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
         if scrolling == "ax":
             self.newXVal = self.actualX
             self.newYVal = self.actualY
-            self.changeSagSlices()
-            self.changeCorSlices()
+            self.markDirty(0, 1)
             self.sagCoverLabel.pixmap().fill(Qt.transparent)
             painter = QPainter(self.sagCoverLabel.pixmap())
             painter.setPen(Qt.yellow)
@@ -949,13 +1021,11 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             corLatLine = QLine(0, int(self.newZVal/self.z*311), 331, int(self.newZVal/self.z*311))
             painter.drawLines([corVertLine, corLatLine])
             painter.end()
-            self.update()
 
         elif scrolling == "sag":
             self.newZVal = self.actualX
             self.newYVal = self.actualY
-            self.changeAxialSlices()
-            self.changeCorSlices()
+            self.markDirty(2, 1)
             self.axCoverLabel.pixmap().fill(Qt.transparent)
             painter = QPainter(self.axCoverLabel.pixmap())
             painter.setPen(Qt.yellow)
@@ -971,13 +1041,11 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             corLatLine = QLine(0, int(self.newZVal/self.z*311), 331, int(self.newZVal/self.z*311))
             painter.drawLines([corVertLine, corLatLine])
             painter.end()
-            self.update()
 
         elif scrolling == "cor":
             self.newXVal = self.actualX
             self.newZVal = self.actualY
-            self.changeAxialSlices()
-            self.changeSagSlices()
+            self.markDirty(2, 0)
             self.axCoverLabel.pixmap().fill(Qt.transparent)
             painter = QPainter(self.axCoverLabel.pixmap())
             painter.setPen(Qt.yellow)
@@ -993,7 +1061,6 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             sagLatLine = QLine(0, int(self.newYVal/self.y*311), 331, int(self.newYVal/self.y*311))
             painter.drawLines([sagVertLine, sagLatLine])
             painter.end()
-            self.update()
 
 
 #----------------------------------------------------------------------------------------------------------------------------------
@@ -1009,7 +1076,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                 if (self.xCur < 811 and self.xCur > 478 and self.yCur < 342 and self.yCur > 29) and (self.painted == "none" or self.painted == "ax"):
                     self.actualX = int((self.xCur - 479)*(self.widthAx-1)/331)
                     self.actualY = int((self.yCur - 30)*(self.heightAx-1)/311)
-                    self.maskCoverImg[self.actualX, self.actualY, self.newZVal] = [0, 0, 255,int(self.curAlpha.value())]
+                    self.curPointVoxels.append((self.actualX, self.actualY, self.newZVal))
                     self.curPointsPlottedX.append(self.actualX)
                     self.curPointsPlottedY.append(self.actualY)
                     self.newPointPlotted = True
@@ -1020,7 +1087,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                 elif (event.x() < 1152 and event.x() > 819 and event.y() < 342 and event.y() > 29) and (self.painted == "none" or self.painted == "sag"):
                     self.actualX = int((self.xCur-820)*(self.widthSag-1)/331)
                     self.actualY = int((self.yCur-30)*(self.heightSag-1)/311)
-                    self.maskCoverImg[self.newXVal, self.actualY, self.actualX] = [0,0,255,int(self.curAlpha.value())]
+                    self.curPointVoxels.append((self.newXVal, self.actualY, self.actualX))
                     self.curPointsPlottedX.append(self.actualX)
                     self.curPointsPlottedY.append(self.actualY)
                     self.newPointPlotted = True
@@ -1031,7 +1098,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                 elif (event.x() < 1152 and event.x() > 819 and event.y() < 702 and event.y() > 389) and (self.painted == "none" or self.painted == "cor"):
                     self.actualX = int((self.xCur-820)*(self.widthCor-1)/331)
                     self.actualY = int((self.yCur-390)*(self.heightCor-1)/311)
-                    self.maskCoverImg[self.actualX, self.newYVal, self.actualY] = [0,0,255,int(self.curAlpha.value())]
+                    self.curPointVoxels.append((self.actualX, self.newYVal, self.actualY))
                     self.curPointsPlottedX.append(self.actualX)
                     self.curPointsPlottedY.append(self.actualY)
                     self.newPointPlotted = True
@@ -1043,7 +1110,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                 if self.id == 1 and self.axialPlane.isHidden() is False and self.sagPlane.isHidden()  and self.corPlane.isHidden() :
                     self.actualX = int((self.widthAx-1)*(self.xCur-470)/680)
                     self.actualY = int((self.heightAx-1)*(self.yCur-30)/638)
-                    self.maskCoverImg[self.actualX, self.actualY, self.newZVal] = [0,0,255,int(self.curAlpha.value())]
+                    self.curPointVoxels.append((self.actualX, self.actualY, self.newZVal))
                     self.curPointsPlottedX.append(self.actualX)
                     self.curPointsPlottedY.append(self.actualY)
                     self.newPointPlotted = True
@@ -1051,7 +1118,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                 elif self.id == 2 and self.sagPlane.isHidden() is False and self.corPlane.isHidden()  and self.axialPlane.isHidden() :
                     self.actualX = int((self.widthSag-1)*(self.xCur-470)/680)
                     self.actualY = int((self.heightSag-1)*(self.yCur-30)/638)
-                    self.maskCoverImg[self.newXVal, self.actualY, self.actualX] = [0,0,255,int(self.curAlpha.value())]
+                    self.curPointVoxels.append((self.newXVal, self.actualY, self.actualX))
                     self.curPointsPlottedX.append(self.actualX)
                     self.curPointsPlottedY.append(self.actualY)
                     self.newPointPlotted = True
@@ -1059,11 +1126,14 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                 elif self.id == 3 and self.corPlane.isHidden() is False and self.axialPlane.isHidden()  and self.sagPlane.isHidden() :
                     self.actualX = int((self.widthCor-1)*(self.xCur-470)/680)
                     self.actualY = int((self.heightCor-1)*(self.yCur-30)/638)
-                    self.maskCoverImg[self.actualX, self.newYVal, self.actualY] = [0,0,255,int(self.curAlpha.value())]
+                    self.curPointVoxels.append((self.actualX, self.newYVal, self.actualY))
                     self.curPointsPlottedX.append(self.actualX)
                     self.curPointsPlottedY.append(self.actualY)
                     self.newPointPlotted = True
                     self.painted = "cor"
+            if self.newPointPlotted:
+                sr.paint_labels(self.maskCoverImg, self.curPointVoxels[-1:])
+                self.maskChanged()
             self.changeSagSlices()
             self.changeCorSlices()
             self.changeAxialSlices()
@@ -1125,6 +1195,8 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
     def mouseMoveEvent(self, event):
         self.xCur = event.x()
         self.yCur = event.y()
+        if self.scrolling:
+            self.update() # Qt folds the moves between two paints into one paintEvent
 
 
 # EIGHTH STEP: when accept polygon is clicked, the draw polygon button
@@ -1139,7 +1211,6 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.feedbackText.setText("VOI Created Successfully")
             self.curPointsPlottedX.append(self.curPointsPlottedX[0])
             self.curPointsPlottedY.append(self.curPointsPlottedY[0])
-            self.maskCoverImg.fill(0)
             x, y = calculateSpline(self.curPointsPlottedX, self.curPointsPlottedY)
             newROI = []
             for i in range(len(x)):
@@ -1153,14 +1224,17 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
                     if len(newROI) == 0 or newROI[-1] != (int(x[i]), self.newYVal, int(y[i])):
                         newROI.append([int(x[i]), self.newYVal, int(y[i])])
             self.pointsPlotted.append(newROI)
-            for i in range(len(self.pointsPlotted)):
-                for j in range(len(self.pointsPlotted[i])):
-                    self.maskCoverImg[self.pointsPlotted[i][j][0], self.pointsPlotted[i][j][1], self.pointsPlotted[i][j][2]] = [0,0,255,int(self.curAlpha.value())]
+            # the clicked points give way to the spline through them; the
+            # other ROIs are left as they are
+            sr.paint_labels(self.maskCoverImg, self.curPointVoxels, -1)
+            sr.paint_labels(self.maskCoverImg, newROI)
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
             self.curPointsPlottedX = []
             self.curPointsPlottedY = []
+            self.curPointVoxels = []
             self.planesDrawn.append(self.painted)
             self.painted = "none"
             self.curROIDrawn = True
@@ -1177,21 +1251,10 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
 
     def undoLastPoint(self):
         if len(self.curPointsPlottedX) != 0:
-            self.maskCoverImg[self.curPointsPlottedX[-1]]
             self.curPointsPlottedX.pop()
             self.curPointsPlottedY.pop()
-            self.maskCoverImg.fill(0)
-            for i in range(len(self.pointsPlotted)):
-                for j in range(len(self.pointsPlotted[i])):
-                    self.maskCoverImg[self.pointsPlotted[i][j][0], self.pointsPlotted[i][j][1], self.pointsPlotted[i][j][2]] = [0,0,255, int(self.curAlpha.value())]
-            for i in range(len(self.curPointsPlottedX)):
-                if self.painted == "ax":
-                    self.maskCoverImg[int(self.curPointsPlottedX[i]), int(self.curPointsPlottedY[i]), self.newZVal] = [0,0,255,int(self.curAlpha.value())]
-                elif self.painted == "sag":
-                    self.maskCoverImg[self.newXVal, int(self.curPointsPlottedY[i]), int(self.curPointsPlottedX[i])] = [0,0,255,int(self.curAlpha.value())]
-                elif self.painted == "cor":
-                    self.maskCoverImg[int(self.curPointsPlottedX[i]), self.newYVal, int(self.curPointsPlottedY[i])] = [0,0,255,int(self.curAlpha.value())]
-
+            sr.paint_labels(self.maskCoverImg, [self.curPointVoxels.pop()], -1)
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
@@ -1213,12 +1276,9 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             if len(self.pointsPlotted) == 0:
                 self.feedbackText.setText("Unable to remove ROI")
             else:
-                self.pointsPlotted.pop()
+                sr.paint_labels(self.maskCoverImg, self.pointsPlotted.pop(), -1)
                 self.planesDrawn.pop()
-                self.maskCoverImg.fill(0)
-                for i in range(len(self.pointsPlotted)):
-                    for j in range(len(self.pointsPlotted[i])):
-                        self.maskCoverImg[self.pointsPlotted[i][j][0], self.pointsPlotted[i][j][1], self.pointsPlotted[i][j][2]] = [0,0,255,int(self.curAlpha.value())]
+                self.maskChanged()
                 self.changeAxialSlices()
                 self.changeSagSlices()
                 self.changeCorSlices()
@@ -1231,65 +1291,76 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
 
     def voi3dInterpolation(self):
         if self.voiComputed == False:
-            points = calculateSpline3D(list(chain.from_iterable(self.pointsPlotted)))
-
-            self.pointsPlotted = []
+            points = list(calculateSpline3D(list(chain.from_iterable(self.pointsPlotted))))
+            # one pass over the frames for all points, instead of a time series
+            # per point, on a worker thread; the ROIs stay as they are until it is done
+            volume = self.data4dImg
+            self.startLoadWorker(lw.TaskWorker(lambda progress: ut.max_over_time(volume, points, progress)), lambda peak: self.finishVoi(points, peak))
+
+    def finishVoi(self, points, peak):
+        self.pointsPlotted = []
+        self.maskCoverImg.fill(0)
+
+        for point, value in zip(points, peak):
+            if value != 0:
+                self.maskCoverImg[tuple(point)] = sr.ROI_LABEL
+                self.pointsPlotted.append(tuple(point))
+        if len(self.pointsPlotted) == 0:
+            self.feedbackText.setText("VOI not in US image.\nDraw new VOI over US image")
+            self.interpolateVOIButton.clicked.disconnect()
+            self.interpolateVOIButton.clicked.connect(lambda:  self.feedbackText.setText("Must have at least 1 ROI per plane to generate VOI"))
             self.maskCoverImg.fill(0)
-            
-            for point in points:
-                if max(self.data4dImg[tuple(point)]) != 0:
-                    self.maskCoverImg[tuple(point)] = [0,0,255,int(self.curAlpha.value())]
-                    self.pointsPlotted.append(tuple(point))
-            if len(self.pointsPlotted) == 0:
-                self.feedbackText.setText("VOI not in US image.\nDraw new VOI over US image")
-                self.interpolateVOIButton.clicked.disconnect()
-                self.interpolateVOIButton.clicked.connect(lambda:  self.feedbackText.setText("Must have at least 1 ROI per plane to generate VOI"))
-                self.maskCoverImg.fill(0)
-                self.changeAxialSlices()
-                self.changeSagSlices()
-                self.changeCorSlices()
-                return
-            
-            mask = np.zeros((self.maskCoverImg.shape[0], self.maskCoverImg.shape[1], self.maskCoverImg.shape[2]))
-
-            for point in self.pointsPlotted:
-                mask[point] = 1
-            from scipy.ndimage import binary_fill_holes
-            for i in range(mask.shape[2]):
-                border = np.where(mask[:,:,i] == 1)
-                if (not len(border[0])) or (max(border[0]) == min(border[0])) or (max(border[1]) == min(border[1])):
-                    continue
-                border = np.array(border).T
-                hull = ConvexHull(border)
-                vertices = border[hull.vertices]
-                shape = vertices.shape
-                vertices = np.reshape(np.append(vertices, vertices[0]), (shape[0]+1, shape[1]))
-
-                # Linear interpolation of 2d convex hull
-                tck, u_ = interpolate.splprep(vertices.T, s=0.0, k=1)
-                splineX, splineY = np.array(interpolate.splev(np.linspace(0, 1, 1000), tck))
-
-                mask[:,:,i] = np.zeros((mask.shape[0], mask.shape[1]))
-                for j in range(len(splineX)):
-                    mask[int(splineX[j]), int(splineY[j]), i] = 1
-                filledMask = binary_fill_holes(mask[:,:,i])
-                maskPoints = np.array(np.where(filledMask == True))
-                for j in range(len(maskPoints[0])):
-                    self.maskCoverImg[maskPoints[0][j], maskPoints[1][j], i] = [0,0,255,int(self.curAlpha.value())]
-                    self.pointsPlotted.append((maskPoints[0][j], maskPoints[1][j], i))
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
-            self.voiComputed = True
-            self.drawPolygonButton.setCheckable(False)
-            self.computeTICButton.clicked.connect(self.showTic)
-            self.interpolateVOIButton.clicked.disconnect()
+            return
+        
+        mask = np.zeros((self.maskCoverImg.shape[0], self.maskCoverImg.shape[1], self.maskCoverImg.shape[2]))
+
+        for point in self.pointsPlotted:
+            mask[point] = 1
+        from scipy.ndimage import binary_fill_holes
+        for i in range(mask.shape[2]):
+            border = np.where(mask[:,:,i] == 1)
+            if (not len(border[0])) or (max(border[0]) == min(border[0])) or (max(border[1]) == min(border[1])):
+                continue
+            border = np.array(border).T
+            hull = ConvexHull(border)
+            vertices = border[hull.vertices]
+            shape = vertices.shape
+            vertices = np.reshape(np.append(vertices, vertices[0]), (shape[0]+1, shape[1]))
+
+            # Linear interpolation of 2d convex hull
+            tck, u_ = interpolate.splprep(vertices.T, s=0.0, k=1)
+            splineX, splineY = np.array(interpolate.splev(np.linspace(0, 1, 1000), tck))
+
+            mask[:,:,i] = np.zeros((mask.shape[0], mask.shape[1]))
+            for j in range(len(splineX)):
+                mask[int(splineX[j]), int(splineY[j]), i] = 1
+            filledMask = binary_fill_holes(mask[:,:,i])
+            maskPoints = np.array(np.where(filledMask == True))
+            for j in range(len(maskPoints[0])):
+                self.maskCoverImg[maskPoints[0][j], maskPoints[1][j], i] = sr.ROI_LABEL
+                self.pointsPlotted.append((maskPoints[0][j], maskPoints[1][j], i))
+        self.maskChanged()
+        self.changeAxialSlices()
+        self.changeSagSlices()
+        self.changeCorSlices()
+        self.voiComputed = True
+        self.drawPolygonButton.setCheckable(False)
+        self.computeTICButton.clicked.connect(self.showTic)
+        self.interpolateVOIButton.clicked.disconnect()
 
     def acceptTIC(self):
         ax = self.fig.add_subplot(111)
         # self.ticEditor.ticY -= min(self.ticEditor.ticY)
         # self.ticEditor.ticY *= len(self.pointsPlotted)
-        ax.plot(self.ticEditor.ticX[:,0], self.ticEditor.ticY)
+        self.ticLine, = ax.plot(self.ticEditor.ticX[:,0], self.ticEditor.ticY)
+        self.ticAx = ax
+        self.ticFrames = [int(i) for i in self.ticEditor.ticX[:,1]]
+        self.ticTimes = list(self.ticEditor.ticX[:,0])
+        self.ticValues = list(self.ticEditor.ticY)
 
         self.sliceArray = self.ticEditor.ticX[:,1]
         if self.slicesChanger.value() >= len(self.sliceArray):
@@ -1361,6 +1432,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             xlist.append(i[0])
             ylist.append(i[1])
             zlist.append(i[2])
+        self.paramapLabels = {}
         # self.masterParamap = ut.paramap(self.OGData4dImg, xlist, ylist, zlist, self.header[1:4], self.header[4], 'BolusLognormal', self.compressValue.value(), int(self.windowHeightValue.value()*self.header[1]), int(self.windowWidthValue.value()*self.header[2]), int(self.windowDepthValue.value()*self.header[3]))
         # self.maxAuc = 0
         # self.minAuc = 9999
@@ -1396,31 +1468,42 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
     def showTic(self):
         if not self.windowsComputed and self.voiComputed:
             self.header = self.nibImg.header['pixdim'] # [dims, voxel dims (3 vals), timeconst, 0, 0, 0]
-            times = [i*self.header[4] for i in range(1, self.OGData4dImg.shape[3]+1)]
             self.voxelScale = self.header[1]*self.header[2]*self.header[3] #/1000/1000/1000 # mm^3
             self.pointsPlotted = [*set(self.pointsPlotted)]
             print("Voxel volume:", self.voxelScale)
             self.voxelScale *= len(self.pointsPlotted)
             print("Num voxels:", len(self.pointsPlotted))
-            simplifiedMask = self.maskCoverImg[:,:,:,2]
-            TIC = ut.generate_TIC(self.OGData4dImg, simplifiedMask, times, self.compressValue.value(),  self.voxelScale)
-
-            # Bunch of checks
-            if np.isnan(np.sum(TIC[:,1])):
-                print('STOPPED:NaNs in the VOI')
-                return;
-            if np.isinf(np.sum(TIC[:,1])):
-                print('STOPPED:InFs in the VOI')
-                return;
-
-            self.ticEditor = TICEditorGUI()
-            self.ticEditor.show()
-            self.ticEditor.accept.clicked.connect(self.acceptTIC)
-            self.ticX = np.array([[TIC[i,0],i] for i in range(len(TIC[:,0]))])
-            self.ticY = TIC[:,1]
-            self.ticEditor.graph(self.ticX, self.ticY)
-            # self.ticEditor.t0Scroll.setValue(int(min(self.ticEditor.ticX[:, 0])))
-            # self.ticEditor.t0ScrollValueChanged()
+            simplifiedMask = self.maskCoverImg
+            # the samples are taken on a worker thread. The raw samples are
+            # kept, so frames that arrive later in a live acquisition only
+            # add one sample each
+            self.ticCompression = self.compressValue.value()
+            self.ticBox, self.ticBoolMask = ut.tic_mask_box(simplifiedMask)
+            volume, compression, voxelScale = self.OGData4dImg, self.ticCompression, self.voxelScale
+            self.startLoadWorker(lw.TaskWorker(lambda progress: ut.tic_samples(volume, simplifiedMask, compression, voxelScale, progress)), self.showTicEditor)
+
+    def showTicEditor(self, ticRaw):
+        self.ticRaw = ticRaw
+        self.ticMin = min(ticRaw)
+        times = [i*self.header[4] for i in range(1, len(ticRaw)+1)]
+        TIC = ut.normalize_TIC(times, ticRaw)
+
+        # Bunch of checks
+        if np.isnan(np.sum(TIC[:,1])):
+            print('STOPPED:NaNs in the VOI')
+            return;
+        if np.isinf(np.sum(TIC[:,1])):
+            print('STOPPED:InFs in the VOI')
+            return;
+
+        self.ticEditor = TICEditorGUI()
+        self.ticEditor.show()
+        self.ticEditor.accept.clicked.connect(self.acceptTIC)
+        self.ticX = np.array([[TIC[i,0],i] for i in range(len(TIC[:,0]))])
+        self.ticY = TIC[:,1]
+        self.ticEditor.graph(self.ticX, self.ticY)
+        # self.ticEditor.t0Scroll.setValue(int(min(self.ticEditor.ticX[:, 0])))
+        # self.ticEditor.t0ScrollValueChanged()
 
     def showAuc(self):
         if self.aucParamapButton.isChecked():
@@ -1431,12 +1514,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.mttParamapButton.setChecked(False)
             cmapStruct = plt.get_cmap('viridis')
             cmap = cmapStruct.colors
-            self.maskCoverImg.fill(0)
-
-            for i in range(len(self.pointsPlotted)):
-                color = cmap[int((255/(self.maxAuc-self.minAuc))*(self.masterParamap[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]][0]-self.minAuc))]
-                color = [color[i]*255 for i in range(len(color))]
-                self.maskCoverImg[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]] = [color[2], color[1], color[0], int(self.curAlpha.value())]
+            self.setOverlay(self.paramapOverlay(0, self.minAuc, self.maxAuc), sr.colormap_colors(cmap))
 
             self.figLeg.clear()
             a = np.array([[0,1]])
@@ -1460,16 +1538,16 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.horizLayoutLeg.addWidget(self.canvasLeg)
             self.canvasLeg.draw()
 
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
 
         elif self.aucParamapButton.isCheckable():
-            self.maskCoverImg.fill(0)
-            for i in range(len(self.pointsPlotted)):
-                self.maskCoverImg[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]] = [0,0,255,int(self.curAlpha.value())]
+            self.setOverlay(self.maskCoverImg, sr.ROI_COLORS)
             self.legend.setHidden(True)
 
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
@@ -1484,12 +1562,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.mttParamapButton.setChecked(False)
             cmapStruct = plt.get_cmap('magma')
             cmap = cmapStruct.colors
-            self.maskCoverImg.fill(0)
-
-            for i in range(len(self.pointsPlotted)):
-                color = cmap[int((255/(self.maxPe-self.minPe))*(self.masterParamap[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]][1]-self.minPe))]
-                color = [color[i]*255 for i in range(len(color))]
-                self.maskCoverImg[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]] = [color[2], color[1], color[0], int(self.curAlpha.value())]
+            self.setOverlay(self.paramapOverlay(1, self.minPe, self.maxPe), sr.colormap_colors(cmap))
 
             self.figLeg.clear()
             a = np.array([[0,1]])
@@ -1513,17 +1586,17 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.horizLayoutLeg.addWidget(self.canvasLeg)
             self.canvasLeg.draw()
 
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
 
         elif self.peParamapButton.isCheckable():
-            self.maskCoverImg.fill(0)
             self.figLeg = plt.figure()
-            for i in range(len(self.pointsPlotted)):
-                self.maskCoverImg[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]] = [0,0,255,int(self.curAlpha.value())]
+            self.setOverlay(self.maskCoverImg, sr.ROI_COLORS)
             self.legend.setHidden(True)
 
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
@@ -1537,12 +1610,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.mttParamapButton.setChecked(False)
             cmapStruct = plt.get_cmap('plasma')
             cmap = cmapStruct.colors
-            self.maskCoverImg.fill(0)
-
-            for i in range(len(self.pointsPlotted)):
-                color = cmap[int((255/(self.maxTp-self.minTp))*(self.masterParamap[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]][2]-self.minTp))]
-                color = [color[i]*255 for i in range(len(color))]
-                self.maskCoverImg[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]] = [color[2], color[1], color[0], int(self.curAlpha.value())]
+            self.setOverlay(self.paramapOverlay(2, self.minTp, self.maxTp), sr.colormap_colors(cmap))
 
             self.figLeg.cs()
             a = np.array([[0,1]])
@@ -1566,16 +1634,16 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.horizLayoutLeg.addWidget(self.canvasLeg)
             self.canvasLeg.draw()
 
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
 
         elif self.tpParamapButton.isCheckable():
-            self.maskCoverImg.fill(0)
-            for i in range(len(self.pointsPlotted)):
-                self.maskCoverImg[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]] = [0,0,255,int(self.curAlpha.value())]
+            self.setOverlay(self.maskCoverImg, sr.ROI_COLORS)
             self.legend.setHidden(True)
 
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
@@ -1589,12 +1657,7 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.tpParamapButton.setChecked(False)
             cmapStruct = plt.get_cmap('cividis')
             cmap = cmapStruct.colors
-            self.maskCoverImg.fill(0)
-
-            for i in range(len(self.pointsPlotted)):
-                color = cmap[int((255/(self.maxMtt-self.minMtt))*(self.masterParamap[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]][3]-self.minMtt))]
-                color = [color[i]*255 for i in range(len(color))]
-                self.maskCoverImg[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]] = [color[2], color[1], color[0], int(self.curAlpha.value())]
+            self.setOverlay(self.paramapOverlay(3, self.minMtt, self.maxMtt), sr.colormap_colors(cmap))
 
             self.figLeg.clear()
             a = np.array([[0,1]])
@@ -1618,25 +1681,172 @@ class Contrast3dAnalysisController(Contrast3dAnalysisGUI):
             self.horizLayoutLeg.addWidget(self.canvasLeg)
             self.canvasLeg.draw()
 
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
 
         elif self.mttParamapButton.isCheckable():
-            self.maskCoverImg.fill(0)
-            for i in range(len(self.pointsPlotted)):
-                self.maskCoverImg[self.pointsPlotted[i][0], self.pointsPlotted[i][1], self.pointsPlotted[i][2]] = [0,0,255,int(self.curAlpha.value())]
+            self.setOverlay(self.maskCoverImg, sr.ROI_COLORS)
             self.legend.setHidden(True)
 
+            self.maskChanged()
             self.changeAxialSlices()
             self.changeSagSlices()
             self.changeCorSlices()
 
     
 
+    def toggleLiveAcquisition(self):
+        if not self.watchFolderButton.isChecked():
+            self.liveTimer.stop()
+            self.feedbackText.setText("Stopped watching acquisition folder")
+            return
+        if not self.inputXmlFileLocation:
+            self.watchFolderButton.setChecked(False)
+            self.feedbackText.setText("Choose the XML folder to watch first")
+            return
+        if self.liveWatcher is None or self.liveWatcher.folder != self.inputXmlFileLocation:
+            self.liveWatcher = lv.AcquisitionWatcher(self.inputXmlFileLocation)
+            self.liveStudyOpen = False
+        self.feedbackText.setText("Watching acquisition folder for new frames")
+        self.liveTimer.start(500)
+
+    def pollAcquisition(self):
+        dropped = len(self.liveWatcher.dropped)
+        added = self.liveWatcher.poll()
+        if len(self.liveWatcher.dropped) > dropped:
+            index, reason = self.liveWatcher.dropped[-1]
+            self.feedbackText.setText("Skipped frame " + os.path.basename(self.liveWatcher.xmlFiles[index]) + ": " + reason)
+        if not added:
+            return
+        if not self.liveStudyOpen:
+            # first frames of the acquisition: open it like any other study
+            self.liveStudyOpen = True
+            self.inputTextPath = self.liveWatcher.folder
+            self.openInitialImageSlices()
+        elif self.data4dImg is self.liveWatcher.volume:
+            self.extendStudy(added)
+
+    def extendStudy(self, added):
+        # For the growing volume of a live acquisition. Only the
+        # new frames are touched: the slice range grows and, once a TIC has
+        # been accepted, one TIC sample is added per frame
+        follow = self.slicesChanger.value() == self.slicesChanger.maximum()
+        self.numSlices = self.data4dImg.shape[3]
+        self.totalSlices.setText(str(self.numSlices))
+        self.sliceArray = np.append(self.sliceArray, np.arange(self.numSlices-added, self.numSlices))
+        self.slicesChanger.setMaximum(len(self.sliceArray)-1)
+        self.pyramid.wake()
+        if follow:
+            self.slicesChanger.setValue(len(self.sliceArray)-1)
+        if self.ticComputed:
+            self.extendLiveTic()
+
+    def extendLiveTic(self):
+        # The normalised TIC is the raw curve minus its minimum, so new frames
+        # only append points; the drawn points move, all by the same offset,
+        # only when a new frame sets a new minimum
+        frameTime = self.nibImg.header['pixdim'][4]
+        oldMin = self.ticMin
+        newPoints = []
+        for t in range(len(self.ticRaw), self.numSlices):
+            value = ut.tic_value(self.OGData4dImg, t, self.ticBox, self.ticBoolMask, self.ticCompression, self.voxelScale)
+            self.ticRaw.append(value)
+            self.ticMin = min(self.ticMin, value)
+            if t > self.ticFrames[-1]:
+                self.ticTimes.append(self.ticTimes[-1] + (t-self.ticFrames[-1])*frameTime)
+                self.ticFrames.append(t)
+                newPoints.append(value)
+        if self.ticMin < oldMin:
+            shift = oldMin - self.ticMin
+            self.ticValues = [y + shift for y in self.ticValues]
+        self.ticValues.extend(value - self.ticMin for value in newPoints)
+        self.ticLine.set_data(self.ticTimes, self.ticValues)
+        if self.ticMin < oldMin:
+            self.ticAx.relim()
+        elif newPoints:
+            n = len(newPoints)
+            self.ticAx.update_datalim(list(zip(self.ticTimes[-n:], self.ticValues[-n:])))
+        self.ticAx.autoscale_view()
+        self.canvas.draw_idle()
+
+    def closeStudy(self):
+        # Stops the threads reading the study on screen, then releases its
+        # frame cache threads and file handles. The live acquisition's volume
+        # belongs to its watcher and is left open.
+        prefetcher = self.prefetcher
+        self.stopCine()
+        if prefetcher is not None:
+            prefetcher.thread.join()
+        if self.pyramid is not None:
+            self.pyramid.close()
+            if self.pyramid.thread is not None:
+                self.pyramid.thread.join()
+            self.pyramid = None
+        study = getattr(self, 'dataNibImg', None)
+        if study is not None and not isinstance(study, lv.GrowingVolume4D):
+            lw.close_study((None, study))
+
+    def closeEvent(self, event):
+        # workers stop at their next frame; none may outlive the window
+        self.liveTimer.stop()
+        for worker in [self.loadWorker] + list(self.retiredWorkers):
+            if worker is not None:
+                worker.cancel()
+                worker.wait()
+        self.closeStudy()
+        super().closeEvent(event)
+
+    def startLoadWorker(self, worker, done):
+        # Only one load, conversion or whole-cine pass runs at a time, and
+        # done(result) is called on the GUI thread when it succeeds. A running
+        # worker is cancelled rather than waited for: it stops at its next
+        # frame, its signals are ignored from then on (an open study it still
+        # hands over is closed), and it is kept referenced until its thread
+        # has finished.
+        if self.loadWorker is not None and self.loadWorker.isRunning():
+            self.loadWorker.cancel()
+            self.retiredWorkers.add(self.loadWorker)
+        self.loadWorker = worker
+        worker.done.connect(lambda result, worker=worker: done(result) if worker is self.loadWorker else worker.discard(result))
+        worker.progressed.connect(lambda message, done, total, worker=worker: self.showLoadProgress(worker, message, done, total))
+        worker.failed.connect(lambda message, worker=worker: self.loadStopped(worker, "Loading failed: " + message))
+        worker.cancelled.connect(lambda worker=worker: self.loadStopped(worker, "Cancelled"))
+        worker.finished.connect(lambda worker=worker: self.workerFinished(worker))
+        self.loadProgressBar.setValue(0)
+        self.loadProgressBar.setHidden(False)
+        self.cancelLoadButton.setHidden(False)
+        worker.start()
+
+    def showLoadProgress(self, worker, message, done, total):
+        if worker is self.loadWorker:
+            self.loadProgressBar.setMaximum(total)
+            self.loadProgressBar.setValue(done)
+            self.feedbackText.setText(message + " " + str(done) + " of " + str(total))
+
+    def workerFinished(self, worker):
+        self.retiredWorkers.discard(worker)
+        self.loadStopped(worker)
+
+    def loadStopped(self, worker, message=None):
+        if worker is self.loadWorker:
+            self.loadProgressBar.setHidden(True)
+            self.cancelLoadButton.setHidden(True)
+            if message is not None:
+                self.feedbackText.setText(message)
+
+    def cancelLoad(self):
+        if self.loadWorker is not None:
+            self.loadWorker.cancel()
+
     def convertXmltoNifti(self):
-        self.inputTextPath = ut.xml2nifti(self.inputXmlFileLocation, self.outputNiftiFileLocation)
+        # xml2nifti runs on a worker thread; the result is opened when it is done
+        worker = lw.ConvertWorker(self.inputXmlFileLocation, self.outputNiftiFileLocation)
+        self.startLoadWorker(worker, self.openConvertedStudy)
 
+    def openConvertedStudy(self, path):
+        self.inputTextPath = path
         if self.inputTextPath:
             self.openInitialImageSlices()
 
@@ -103,6 +103,22 @@ class Contrast3dAnalysisGUI(QMainWindow):
         self.slicesChanger.setMinimum(0)
         self.slicesChanger.setDisabled(True)
 
+        self.cinePlayButton = QPushButton(self)
+        self.cinePlayButton.setGeometry(QRect(470, 465, 58, 32))
+        self.cinePlayButton.setObjectName("cinePlayButton")
+        self.cinePlayButton.setDisabled(True)
+
+        self.cineFps = QDoubleSpinBox(self)
+        self.cineFps.setFocusPolicy(Qt.StrongFocus)
+        self.cineFps.move(755, 470)
+        self.cineFps.resize(58, 22)
+        self.cineFps.setMinimum(1)
+        self.cineFps.setMaximum(60)
+        self.cineFps.setSingleStep(1)
+        self.cineFps.setDecimals(0)
+        self.cineFps.setValue(10)
+        self.cineFps.setSuffix(" fps")
+
         self.alphaTracker = QProgressBar(self)
         self.alphaTracker.move(510, 550)
         self.alphaTracker.resize(221, 32)
@@ -436,6 +452,10 @@ class Contrast3dAnalysisGUI(QMainWindow):
         self.convertXmlButton.setGeometry(QRect(240, 235, 201, 32))
         self.convertXmlButton.setObjectName("convertXmlButton")
 
+        self.watchFolderButton = QPushButton(self)
+        self.watchFolderButton.setGeometry(QRect(240, 262, 201, 32))
+        self.watchFolderButton.setObjectName("watchFolderButton")
+
         self.saveBeamshapeMaskButton = QPushButton(self)
         self.saveBeamshapeMaskButton.setGeometry(QRect(260, 200, 171, 32))
         self.saveBeamshapeMaskButton.setObjectName("saveBeamshapeMaskButton")
@@ -462,6 +482,16 @@ class Contrast3dAnalysisGUI(QMainWindow):
         self.feedbackScrollBar.setObjectName("feedbackScrollBar")
         self.feedbackScrollBar.setHidden(True)
 
+        self.loadProgressBar = QProgressBar(self)
+        self.loadProgressBar.setGeometry(QRect(20, 272, 111, 20))
+        self.loadProgressBar.setObjectName("loadProgressBar")
+        self.loadProgressBar.setHidden(True)
+
+        self.cancelLoadButton = QPushButton(self)
+        self.cancelLoadButton.setGeometry(QRect(130, 267, 81, 30))
+        self.cancelLoadButton.setObjectName("cancelLoadButton")
+        self.cancelLoadButton.setHidden(True)
+
         self.computeTICButton = QPushButton(self)
         self.computeTICButton.setGeometry(QRect(230, 370, 221, 32))
         self.computeTICButton.setObjectName("computeTICButton")
@@ -548,6 +578,7 @@ class Contrast3dAnalysisGUI(QMainWindow):
         self.pointsPlotted = []
         self.curPointsPlottedX = []
         self.curPointsPlottedY = []
+        self.curPointVoxels = []
         self.planesDrawn = []
         self.painted = "none"
 
@@ -587,6 +618,9 @@ class Contrast3dAnalysisGUI(QMainWindow):
         self.clearOutputFolderButton.setText(_translate("3D Contrast Analysis", "Clear Path"))
         self.instrFunctLabel_2.setText(_translate("3D Contrast Analysis", "Extra Display Functions:"))
         self.convertXmlButton.setText(_translate("3D Contrast Analysis", "Convert XML/Raw to .nii.gz"))
+        self.watchFolderButton.setText(_translate("3D Contrast Analysis", "Watch Folder (Live)"))
+        self.cancelLoadButton.setText(_translate("3D Contrast Analysis", "Cancel"))
+        self.cinePlayButton.setText(_translate("3D Contrast Analysis", "Play"))
         self.saveBeamshapeMaskButton.setText(_translate("3D Contrast Analysis", "Save Beamshape Mask"))
         self.saveMipMaskButton.setText(_translate("3D Contrast Analysis", "Save MIP Mask"))
         self.feedbackLabel.setText(_translate("3D Contrast Analysis", "Feedback:"))
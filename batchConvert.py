@@ -0,0 +1,168 @@
+# Headless batch conversion of XML/RAW acquisition folders with xml2nifti.
+# Does not import PyQt5, so it runs on compute nodes without a display.
+#
+#   python batchConvert.py ROOT DESTINATION -j 8
+#
+# Every folder under ROOT that holds *.xml frames is converted into
+# DESTINATION, N folders at a time. The tree under ROOT is mirrored, so
+# ROOT/patA/scan is written to DESTINATION/patA/scan.nii.gz and folders with
+# the same name never share an output. Per-folder status is kept in
+# DESTINATION/batchStatus.json, keyed by absolute output path; a rerun skips
+# folders whose output is recorded as done and is newer than every input
+# file, so an interrupted run picks up where it stopped.
+import os, sys, json, argparse, traceback
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import utils as ut
+
+STATUS_NAME = 'batchStatus.json'
+
+
+def find_acquisition_folders(root):
+    folders = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if any(f.endswith('.xml') and not f.endswith('.mevis.xml') for f in filenames):
+            folders.append(os.path.abspath(dirpath))
+    return folders
+
+
+def folder_destination(root, folder, destination):
+    # directory the output of folder goes to: its parent's place under root,
+    # mirrored under destination
+    if os.path.abspath(folder) == os.path.abspath(root):
+        return destination
+    return os.path.normpath(os.path.join(destination, os.path.relpath(os.path.dirname(folder), os.path.abspath(root))))
+
+
+def output_paths(root, folders, destination, fmt):
+    # output file of every folder; exits if two folders would write the same file
+    outputs = {}
+    for folder in folders:
+        outputFile = os.path.abspath(ut.xml2nifti_output_path(folder, folder_destination(root, folder, destination), fmt))
+        if outputFile in outputs:
+            sys.exit('Both %s and %s would be converted to %s' % (outputs[outputFile], folder, outputFile))
+        outputs[outputFile] = folder
+    return {folder: outputFile for outputFile, folder in outputs.items()}
+
+
+def newest_input_mtime(folder):
+    newest = 0
+    for xmlname in ut.list_xml_frames(folder):
+        newest = max(newest, os.path.getmtime(xmlname))
+        rawname = ut.raw_filename(xmlname)
+        if os.path.exists(rawname):
+            newest = max(newest, os.path.getmtime(rawname))
+    return newest
+
+
+def is_current(folder, entry, outputFile):
+    # Only outputs the status file records as finished count; a file left
+    # behind by an interrupted job has a fresh mtime but no 'done' entry
+    return entry is not None and entry.get('status') == 'done' and os.path.exists(outputFile) \
+        and os.path.getmtime(outputFile) >= newest_input_mtime(folder)
+
+
+def load_status(destination):
+    try:
+        with open(os.path.join(destination, STATUS_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_status(destination, status):
+    path = os.path.join(destination, STATUS_NAME)
+    with open(path+'.tmp', 'w') as f:
+        json.dump(status, f, indent=1)
+    os.replace(path+'.tmp', path)
+
+
+def convert_folder(folder, destination, options):
+    # destination is the folder's own output directory (folder_destination)
+    # Runs in a worker process. xml2nifti exits the interpreter on 2D data, so
+    # SystemExit is caught along with ordinary errors.
+    start = datetime.now()
+    try:
+        outputFile = ut.xml2nifti(folder, destination, **options)
+    except BaseException as e:
+        return {'status': 'failed', 'error': ''.join(traceback.format_exception_only(type(e), e)).strip(),
+                'seconds': (datetime.now()-start).total_seconds()}
+    return {'status': 'done', 'output': outputFile, 'seconds': (datetime.now()-start).total_seconds()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert every XML/RAW acquisition folder under a root directory.')
+    parser.add_argument('root', help='directory searched for acquisition folders')
+    parser.add_argument('destination', help='directory the converted studies are written to')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='folders converted at once (default: CPUs / workers)')
+    parser.add_argument('--workers', type=int, default=1, help='processes reading the frames of each folder')
+    parser.add_argument('--format', default='nii.gz', choices=sorted(ut.OUTPUT_EXTENSIONS), help='output format')
+    parser.add_argument('--streaming', action='store_true', help='bounded-memory conversion (two passes over the frames)')
+    parser.add_argument('--compresslevel', type=int, default=None, help='gzip level for .nii.gz output')
+    parser.add_argument('--compress-threads', type=int, default=1, help='threads deflating each .nii.gz')
+    parser.add_argument('--crop-budget', type=int, default=None,
+                        help='run the auto-crop on a preview of at most this many pixels per projection (e.g. %d); default: full resolution' % ut.AUTOCROP_PREVIEW_PIXELS)
+    parser.add_argument('--force', action='store_true', help='convert folders even when their output is current')
+    args = parser.parse_args(argv)
+    # status entries are keyed by absolute output path and record absolute
+    # folders, so a rerun from another directory or with the root spelled
+    # differently still finds them
+    args.root = os.path.abspath(args.root)
+    args.destination = os.path.abspath(args.destination)
+
+    # every job runs its own pool of frame readers, so jobs*workers processes
+    # are kept within the CPU count
+    cpus = os.cpu_count() or 1
+    args.workers = max(1, args.workers)
+    maxJobs = max(1, cpus // args.workers)
+    if args.jobs is None:
+        args.jobs = maxJobs
+    elif args.jobs > maxJobs:
+        print('Running', maxJobs, 'jobs instead of', args.jobs, 'so', args.workers, 'frame readers each fit on', cpus, 'CPUs')
+        args.jobs = maxJobs
+
+    os.makedirs(args.destination, exist_ok=True)
+    options = {'streaming': args.streaming, 'fmt': args.format,
+               'compresslevel': args.compresslevel, 'compressThreads': args.compress_threads,
+               'cropBudget': args.crop_budget, 'workers': args.workers}
+
+    status = load_status(args.destination)
+    folders = find_acquisition_folders(args.root)
+    outputs = output_paths(args.root, folders, args.destination, args.format)
+    todo = []
+    for folder in folders:
+        outputFile = outputs[folder]
+        if not args.force and is_current(folder, status.get(outputFile), outputFile):
+            print('Up to date:', folder)
+        else:
+            todo.append(folder)
+    print(len(folders), 'acquisition folders,', len(todo), 'to convert,', args.jobs, 'at a time with', args.workers, 'frame readers each')
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {}
+        for folder in todo:
+            folderDestination = folder_destination(args.root, folder, args.destination)
+            os.makedirs(folderDestination, exist_ok=True)
+            status[outputs[folder]] = {'status': 'running', 'folder': folder, 'started': str(datetime.now())}
+            futures[pool.submit(convert_folder, folder, folderDestination, options)] = folder
+        save_status(args.destination, status)
+        for future in as_completed(futures):
+            folder = futures[future]
+            result = future.result()
+            result['folder'] = folder
+            result['finished'] = str(datetime.now())
+            status[outputs[folder]] = result
+            save_status(args.destination, status)
+            if result['status'] == 'done':
+                print('Converted', folder, 'in', round(result['seconds'], 1), 's')
+            else:
+                failed += 1
+                print('FAILED', folder, ':', result['error'])
+    print('Finished:', len(todo)-failed, 'converted,', failed, 'failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
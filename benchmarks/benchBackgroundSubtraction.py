@@ -0,0 +1,32 @@
+# Peak heap memory of the xml2nifti background-subtraction stage, old
+# int16 round trip against the in-place uint8 subtract_background, relative
+# to the size of the study being cleaned.
+#
+#   python benchmarks/benchBackgroundSubtraction.py [numFrames]
+import os, sys, tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import utils as ut
+from syntheticStudy import write_synthetic_study
+from benchRead3D import CUT, measure
+
+def legacy_subtraction(imarray_org):
+    # Background removal as xml2nifti did it before subtract_background
+    imarray_tosub = np.min(imarray_org[:,:,:,:,:,:],axis=1)
+    imarray_org = (imarray_org - imarray_tosub).astype('int16')
+    del imarray_tosub
+    imarray_org[imarray_org < 0] = 0
+    imarray_org = imarray_org.astype('uint8')
+    return imarray_org
+
+if __name__ == '__main__':
+    numFrames = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    with tempfile.TemporaryDirectory() as folder:
+        write_synthetic_study(folder, numFrames=numFrames)
+        study, res, time = ut.read3D(folder, 0, CUT)
+        expected, peak, elapsed = measure(legacy_subtraction, study)
+        print('legacy int16 subtraction: study %.1f MB, extra peak %.1f MB (%.2fx), %.2f s' % (study.nbytes/1e6, peak/1e6, peak/study.nbytes, elapsed))
+        background, peak, elapsed = measure(ut.subtract_background, study, 1)
+        print('subtract_background:      study %.1f MB, extra peak %.1f MB (%.2fx), %.2f s' % (study.nbytes/1e6, peak/1e6, peak/study.nbytes, elapsed))
+        print('identical output:', np.array_equal(expected, study))
@@ -0,0 +1,45 @@
+# RF to B-mode conversion of the .mat input: the old hilbert call per column
+# in float64 against the batched float32 rf_planes_to_bmode, on synthetic RF
+# planes the size of one rf_data_all_fund cell array (2 x 5 planes).
+#
+#   python benchmarks/benchEnvelope.py [samples] [lines]
+import os, sys
+from datetime import datetime
+import numpy as np
+from scipy.signal import hilbert
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import utils as ut
+
+def legacy_bmode(planes):
+    # Envelope detection as openInitialImageSlices did it before rf_planes_to_bmode
+    out = []
+    for temp in planes:
+        other_temp = temp.copy()
+        for k in range(temp.shape[1]):
+            other_temp[:,k] = 20*np.log10(abs(hilbert(temp[:,k])))
+        out.append(other_temp)
+    return out
+
+def synthetic_planes(samples, lines, numPlanes=10):
+    rng = np.random.default_rng(0)
+    t = np.arange(samples)[:, None]
+    carrier = np.sin(2*np.pi*0.1*t)
+    return [carrier*rng.normal(1., .3, (samples, lines)) + rng.normal(0, .05, (samples, lines)) for i in range(numPlanes)]
+
+def timed(func, *args):
+    start = datetime.now()
+    out = func(*args)
+    return out, (datetime.now() - start).total_seconds()
+
+if __name__ == '__main__':
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    planes = synthetic_planes(samples, lines)
+    expected, legacy = timed(legacy_bmode, planes)
+    print('legacy per-column hilbert: %.3f s' % legacy)
+    single, elapsed = timed(lambda p: [ut.rf_to_bmode(plane) for plane in p], planes)
+    print('rf_to_bmode, one thread:   %.3f s (%.1fx)' % (elapsed, legacy/elapsed))
+    result, elapsed = timed(ut.rf_planes_to_bmode, planes)
+    print('rf_planes_to_bmode:        %.3f s (%.1fx)' % (elapsed, legacy/elapsed))
+    print('max difference: %.2e dB' % max(np.max(np.abs(r - e)) for r, e in zip(result, expected)))
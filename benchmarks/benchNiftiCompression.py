@@ -0,0 +1,44 @@
+# Times each NIfTI output mode of write_nifti_frames on a synthetic 4D study
+# and checks that nibabel reads every file back unchanged.
+#
+#   python benchmarks/benchNiftiCompression.py [numFrames] [threads]
+import os, sys, tempfile
+from datetime import datetime
+import numpy as np
+import nibabel as nib
+from scipy.ndimage import uniform_filter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import utils as ut
+
+def synthetic_frames(numFrames, shape=(96, 160, 160)):
+    # smoothed speckle inside a dark border, roughly as compressible as B-mode
+    rng = np.random.default_rng(0)
+    base = uniform_filter(rng.integers(0, 255, size=shape).astype(np.float32), 3)
+    frames = np.zeros((numFrames,)+shape, dtype=np.uint8)
+    for t in range(numFrames):
+        frame = base*(0.5+0.5*np.sin(t/numFrames*np.pi))
+        frames[t, 8:-8, 16:-16, 16:-16] = frame[8:-8, 16:-16, 16:-16].astype(np.uint8)
+    return frames
+
+if __name__ == '__main__':
+    numFrames = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    frames = synthetic_frames(numFrames)
+    shape = (frames.shape[3], frames.shape[2], frames.shape[1], frames.shape[0])
+    pixdim = [4., 0.5, 0.4, 0.3, 0.5, 0., 0., 0.]
+    print('study %.1f MB, %d frames, %d cpus' % (frames.nbytes/1e6, numFrames, os.cpu_count() or 1))
+    modes = [('uncompressed .nii', '.nii', {}),
+             ('gzip level 6', '.nii.gz', {'compresslevel': 6}),
+             ('gzip level 1 (fast)', '.nii.gz', {'compresslevel': 1}),
+             ('parallel gzip level 6, %d threads' % threads, '.nii.gz', {'compresslevel': 6, 'compressThreads': threads}),
+             ('parallel gzip level 1, %d threads' % threads, '.nii.gz', {'compresslevel': 1, 'compressThreads': threads})]
+    with tempfile.TemporaryDirectory() as folder:
+        for label, ext, kwargs in modes:
+            path = os.path.join(folder, 'study'+ext)
+            start = datetime.now()
+            ut.write_nifti_frames(path, shape, pixdim, frames, **kwargs)
+            elapsed = (datetime.now() - start).total_seconds()
+            back = np.asanyarray(nib.load(path).dataobj)
+            assert (back == frames.transpose(3, 2, 1, 0)).all()
+            print('%-36s %6.2f s  %7.1f MB' % (label, elapsed, os.path.getsize(path)/1e6))
@@ -0,0 +1,65 @@
+# Peak resident memory of read3D relative to the size of the study it
+# returns, against the original read3D (legacyRead3D.py, copied from commit
+# e08eee7) on the same synthetic study. Each loader runs in its own
+# subprocess so ru_maxrss covers memmapped pages and numpy buffers alike.
+#
+#   python benchmarks/benchRead3D.py [numFrames]
+import os, sys, json, hashlib, resource, subprocess, tempfile, tracemalloc
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+CUT = [[-1,-1,5,5],[-1,-1,25,5],[-1,-1,5,5]]
+
+def run_loader(name, folder):
+    # Runs in the child: import, note the baseline RSS, load, report
+    if name == 'legacy':
+        from legacyRead3D import read3D
+    else:
+        from utils import read3D
+    import numpy as np
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = datetime.now()
+    study, res, time = read3D(folder, 0, [list(c) for c in CUT])
+    elapsed = (datetime.now() - start).total_seconds()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    study = np.ascontiguousarray(study)
+    return {'before': before*1024, 'peak': peak*1024, 'elapsed': elapsed,
+            'nbytes': study.nbytes, 'shape': study.shape,
+            'digest': hashlib.sha1(study.data).hexdigest()}
+
+def measure(func, *args):
+    # Peak traced heap of an in-process call, for benchmarks that only touch
+    # numpy buffers
+    tracemalloc.start()
+    start = datetime.now()
+    out = func(*args)
+    elapsed = (datetime.now() - start).total_seconds()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, peak, elapsed
+
+def measure_rss(name, folder):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, folder],
+                         stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        result = run_loader(sys.argv[2], sys.argv[3])
+        print(json.dumps(result))
+        sys.exit(0)
+
+    from syntheticStudy import write_synthetic_study
+    numFrames = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    with tempfile.TemporaryDirectory() as folder:
+        write_synthetic_study(folder, numFrames=numFrames)
+        results = {}
+        for name in ('legacy', 'read3D'):
+            r = results[name] = measure_rss(name, folder)
+            grown = r['peak'] - r['before']
+            print('%-7s study %.1f MB, peak RSS %.1f MB (+%.1f MB over imports, %.2fx), %.2f s'
+                  % (name, r['nbytes']/1e6, r['peak']/1e6, grown/1e6, grown/r['nbytes'], r['elapsed']))
+        same = results['legacy']['digest'] == results['read3D']['digest'] and results['legacy']['shape'] == results['read3D']['shape']
+        print('shape %s, identical output: %s' % (tuple(results['read3D']['shape']), same))
@@ -0,0 +1,100 @@
+# Slice-render latency of a crosshair move over the axial view: the sagittal
+# and coronal planes are cut out of the current frame and turned into the
+# C-contiguous display-ordered arrays QImage takes. Old flipud/rot90/require
+# chains against sliceRenderer.PlaneRenderer, on a synthetic volume, for the
+# image alone and with the mask overlay: the float64 (x, y, z, 4) maskCoverImg
+# the viewer used to allocate, cast to uint8 on every render, against the
+# uint8 label volume it allocates now, coloured per plane by a lookup table.
+#
+#   python benchmarks/benchSliceRender.py [x y z numFrames]
+import os, sys
+from datetime import datetime
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import sliceRenderer as sr
+import volumePyramid as vp
+
+def legacy_planes(data4dImg, maskCoverImg, x, y, t):
+    # changeSagSlices/changeCorSlices before the display-ordered planes
+    data2dSag = data4dImg[x,:,:,t]
+    data2dSag = np.flipud(data2dSag)
+    data2dSag = np.rot90(data2dSag,2)
+    data2dSag = np.fliplr(data2dSag)
+    data2dSag = np.require(data2dSag,np.uint8,'C')
+    data2dCor = data4dImg[:,y,:,t]
+    data2dCor = np.rot90(data2dCor,1)
+    data2dCor = np.flipud(data2dCor)
+    data2dCor = np.require(data2dCor,np.uint8,'C')
+    if maskCoverImg is None:
+        return data2dSag, data2dCor
+    tempSag = maskCoverImg[x,:,:,:]
+    tempSag = np.flipud(tempSag)
+    tempSag = np.rot90(tempSag,2)
+    tempSag = np.fliplr(tempSag)
+    tempSag = np.require(tempSag,np.uint8,'C')
+    tempCor = maskCoverImg[:,y,:,:]
+    tempCor = np.rot90(tempCor,1)
+    tempCor = np.flipud(tempCor)
+    tempCor = np.require(tempCor,np.uint8,'C')
+    return data2dSag, data2dCor, tempSag, tempCor
+
+def new_planes(planes, maskCoverImg, x, y, t, lut=None):
+    data2dSag = planes.plane(0, x, t, (331,311))
+    data2dCor = planes.plane(1, y, t, (331,311))
+    if maskCoverImg is None:
+        return data2dSag, data2dCor
+    if lut is None:
+        tempSag = np.require(sr.display_plane(maskCoverImg, 0, x), np.uint8, 'C')
+        tempCor = np.require(sr.display_plane(maskCoverImg, 1, y), np.uint8, 'C')
+    else:
+        tempSag = sr.argb_plane(maskCoverImg, lut, 0, x)
+        tempCor = sr.argb_plane(maskCoverImg, lut, 1, y)
+    return data2dSag, data2dCor, tempSag, tempCor
+
+def per_move_ms(render, moves):
+    render(*moves[0])
+    render(*moves[1]) # second plane of an axis in a frame builds its layout
+    start = datetime.now()
+    for move in moves[2:]:
+        render(*move)
+    return (datetime.now()-start).total_seconds()*1000/(len(moves)-2)
+
+if __name__ == '__main__':
+    shape = tuple(int(a) for a in sys.argv[1:5]) if len(sys.argv) > 4 else (400, 400, 300, 4)
+    rng = np.random.default_rng(0)
+    volume = rng.integers(0, 256, shape[0:3] + (1,), dtype=np.uint8).repeat(shape[3], axis=3)
+    moves = [(x, x*shape[1]//shape[0], 1) for x in range(0, shape[0], 2)]
+
+    # no downsampled levels, so both paths cut the same full resolution planes
+    planes = sr.PlaneRenderer(vp.VolumePyramid(volume, (331, 311), factors=()))
+    for a, b in zip(legacy_planes(volume, None, 7, 9, 1), new_planes(planes, None, 7, 9, 1)):
+        assert np.array_equal(a, b)
+
+    start = datetime.now()
+    sr.display_layout(volume[..., 0], 0), sr.display_layout(volume[..., 0], 1)
+    print('volume %s, %d crosshair moves over the axial view' % (shape, len(moves)-2))
+    print('one-time layout build for both planes of a frame: %.1f ms' % ((datetime.now()-start).total_seconds()*1000))
+    print('image only:   legacy %.3f ms/move, display-ordered %.3f ms/move' % (
+        per_move_ms(lambda x, y, t: legacy_planes(volume, None, x, y, t), moves),
+        per_move_ms(lambda x, y, t: new_planes(planes, None, x, y, t), moves)))
+    maskCoverImg = np.zeros(shape[0:3] + (4,))
+    labels = sr.label_volume(shape[0:3])
+    lut = sr.overlay_lut(sr.ROI_COLORS, 255)
+    maskCoverImg[7, ::3, ::2] = labels[7, ::3, ::2] = sr.ROI_LABEL
+    maskCoverImg[..., 0:3][labels == sr.ROI_LABEL] = sr.ROI_COLORS[sr.ROI_LABEL]
+    maskCoverImg[..., 3][labels == sr.ROI_LABEL] = 255
+    for a, b in zip(new_planes(planes, maskCoverImg, 7, 9, 1), new_planes(planes, labels, 7, 9, 1, lut)):
+        assert np.array_equal(a, b)
+    print('float64 mask: legacy %.3f ms/move, display-ordered %.3f ms/move (%.0f MB)' % (
+        per_move_ms(lambda x, y, t: legacy_planes(volume, maskCoverImg, x, y, t), moves),
+        per_move_ms(lambda x, y, t: new_planes(planes, maskCoverImg, x, y, t), moves),
+        maskCoverImg.nbytes/2**20))
+    del maskCoverImg
+    print('label volume: display-ordered %.3f ms/move (%.0f MB)' % (
+        per_move_ms(lambda x, y, t: new_planes(planes, labels, x, y, t, lut), moves),
+        labels.nbytes/2**20))
+    start = datetime.now()
+    for alpha in range(256):
+        lut = sr.overlay_lut(sr.ROI_COLORS, alpha)
+    print('new colour map or alpha: %.4f ms' % ((datetime.now()-start).total_seconds()*1000/256))
@@ -0,0 +1,70 @@
+# Round trip of utils.iter_mat_cell: writes a small cell array as a v5 .mat
+# (scipy) and in the v7.3 layout (h5py, as MATLAB lays it out) and checks
+# that both read back as the original arrays in row-major cell order.
+#
+#   python benchmarks/checkMatCell.py
+import os, sys, tempfile
+import numpy as np
+from scipy.io import savemat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import utils as ut
+
+NAME = 'rf_data_all_fund'
+
+def make_cell(rows=2, cols=3, shape=(5, 4)):
+    rng = np.random.default_rng(0)
+    return [[rng.standard_normal(shape).astype(np.float64) for j in range(cols)] for i in range(rows)]
+
+def write_v5(filename, cell):
+    obj = np.empty((len(cell), len(cell[0])), dtype=object)
+    for i, row in enumerate(cell):
+        for j, a in enumerate(row):
+            obj[i, j] = a
+    savemat(filename, {NAME: obj, 'other': np.zeros(3)})
+
+def write_v73(filename, cell):
+    # MATLAB's v7.3 layout: a 512 byte text header as HDF5 user block, every
+    # matrix stored transposed under #refs#, the cell as a (cols, rows)
+    # dataset of object references
+    import h5py
+    with h5py.File(filename, 'w', userblock_size=512) as f:
+        refs = f.create_group('#refs#')
+        cellRefs = f.create_dataset(NAME, (len(cell[0]), len(cell)), dtype=h5py.ref_dtype)
+        for i, row in enumerate(cell):
+            for j, a in enumerate(row):
+                dataset = refs.create_dataset('r%d_%d' % (i, j), data=a.T)
+                dataset.attrs['MATLAB_class'] = np.bytes_('double')
+                cellRefs[j, i] = dataset.ref
+        cellRefs.attrs['MATLAB_class'] = np.bytes_('cell')
+        f.create_dataset('other', data=np.zeros((3, 1)))
+    with open(filename, 'r+b') as fh:
+        fh.write(b'MATLAB 7.3 MAT-file'.ljust(512, b' '))
+
+def check(filename, cell, rows=None, cols=None):
+    expected = [a for row in cell[:rows] for a in row[:cols]]
+    got = list(ut.iter_mat_cell(filename, NAME, rows=rows, cols=cols))
+    assert len(got) == len(expected), (len(got), len(expected))
+    for a, b in zip(got, expected):
+        assert a.dtype == np.float32 and a.shape == b.shape, (a.dtype, a.shape, b.shape)
+        assert np.array_equal(a, b.astype(np.float32))
+
+if __name__ == '__main__':
+    cell = make_cell()
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'v5.mat')
+        write_v5(filename, cell)
+        check(filename, cell)
+        check(filename, cell, rows=1, cols=2)
+        print('v5 round trip: ok')
+
+        try:
+            import h5py
+        except ImportError:
+            print('v7.3 round trip: skipped, h5py is not installed')
+            sys.exit(0)
+        filename = os.path.join(folder, 'v73.mat')
+        write_v73(filename, cell)
+        check(filename, cell)
+        check(filename, cell, rows=1, cols=2)
+        print('v7.3 round trip: ok')
@@ -0,0 +1,185 @@
+# read_xmlraw_image_func and read3D copied verbatim from utils.py as of
+# commit e08eee7, before the preallocated frame assembly, so
+# benchRead3D.py can compare against the original loader.
+from __future__ import print_function
+import glob
+import numpy as np
+import xml.etree.ElementTree as ET
+from skimage.morphology import disk
+from skimage.filters import threshold_otsu, rank
+
+def read_xmlraw_image_func(filename):    
+    # get .raw filename
+    filename_raw=filename[0:len(filename)-3]+('0.raw');
+    fff = open(filename_raw,'rb')
+
+    # parsing xml file
+    tree = ET.parse(filename);
+    root = tree.getroot();
+
+    # ADD MAX FRAMES TO LOAD
+    numfiles = len(root); # Comment this out if using max num frames on next lines
+
+    for i in range(0, numfiles):
+        if  root[i].tag=='Columns':
+          M=int(root[i].text);
+        if  root[i].tag=='Rows':
+          N=int(root[i].text);  
+        if  (root[i].find('Geometry') == None) == False:
+          geometry = root[i].find('Geometry')
+          if not geometry:
+              continue
+          layer = geometry.find('Layers')
+          if not layer:
+              continue
+          layer = layer.find('Layer')
+          if not layer:
+              continue
+          regionLocationMaxz1 = layer.find('RegionLocationMaxz1')
+          physicalDeltaX = layer.find('PhysicalDeltaX')
+          physicalDeltaY = layer.find('PhysicalDeltaY')
+          physicalDeltaZ = layer.find('PhysicalDeltaZ')
+          if regionLocationMaxz1:
+              P=int(regionLocationMaxz1.text)+1
+          if physicalDeltaX:
+              voxelX = float(physicalDeltaX.text)
+          if physicalDeltaY:
+              voxelY = float(physicalDeltaY.text)
+          if physicalDeltaZ:
+              voxelZ = float(physicalDeltaZ.text)
+          try:
+              voxel=[float(physicalDeltaX.text)*10, float(physicalDeltaY.text)*10, float(physicalDeltaZ.text)*10] # cm to mm
+              P=int(regionLocationMaxz1.text)+1
+          except:
+              continue
+          
+        if root[i].tag=='AcquisitionDateTime':
+          tval=root[i].text;
+          dateStr=tval[0:4]+'-'+tval[4:6]+'-'+tval[6:8]+' '+tval[8:10]+':'+tval[10:12]+':'+tval[12:len(tval)];
+          time=float(tval[12:len(tval)])+float(tval[10:12])*60+float(tval[8:10])*3600;
+    
+    x = np.fromfile(fff,dtype=np.uint8)
+
+    try:
+        P
+    except NameError:
+        P = int(x.size / M / N)
+        voxel=[(P-1)*10, (P-1)*10, (P-1)*10]
+
+    shapes = (M,N,P);
+    img = np.reshape(x, (P,N,M))
+
+    return img, voxel, time, shapes, dateStr
+
+def read3D(data, newres, cut):#=[[-1,-1,5,5],[-1,-1,25,5],[-1,-1,5,5]]):
+    # cut=[[10,15,5,5],[50,5,20,4],[15,15,5,5]] #Size reduce with user selected caps
+    # cut=[[-1,-1,5,5],[-1,-1,5,5],[-1,-1,5,5]] #Automatic size reduce
+    # cut=[[0,0,5,5],[0,0,20,4],[0,0,5,5]] # Keep original size      
+ 
+    N_lines_z_axis_cut=cut[0][0:2] #10,10   
+    N_lines_z_axis_cut_limit=cut[0][2:4]#5,5
+    N_lines_y_axis_cut=cut[1][0:2]#50,5  
+    N_lines_y_axis_cut_limit=cut[1][2:4]#20,5
+    N_lines_x_axis_cut=cut[2][0:2]##[15, 15]    
+    N_lines_x_axis_cut_limit=cut[2][2:4]#5,5
+    xmldir = data+('/*.xml');
+    xmlnamedir = sorted(glob.glob(xmldir));
+
+    # Ignore .mevis.xml files
+    for file in xmlnamedir:
+        if (len(file) >= 10 and file[-10:] == ".mevis.xml"):
+            xmlnamedir.remove(file)
+
+    if not len(xmlnamedir):
+        print("No XML files found in folder")
+        return
+
+        
+    imarray = []#np.zeros((len(xmlnamedir),shapes[2],shapes[1],shapes[0]),dtype='uint8')
+    timeinitial = -1000; ix=-1;
+    imi_mid, res, timelast, shapes, dateStr = read_xmlraw_image_func(xmlnamedir[np.uint16(len(xmlnamedir)/2)]); 
+    imi10, res, timelast, shapes, dateStr = read_xmlraw_image_func(xmlnamedir[10]); 
+    imi_mid, res, timelast, shapes, dateStr = read_xmlraw_image_func(xmlnamedir[1]);
+
+    finalRes = res
+    
+    finalImi = []
+    prevX = -1
+    for xmlname in xmlnamedir:
+        #imarray[0,xmlnamedir.index(xmlname),0,:,:,:], res, timelast, shapes, dateStr = read_xmlraw_image_func(xmlname)
+        imi, res, timelast, shapes, dateStr = read_xmlraw_image_func(xmlname); 
+        sz=imi.shape
+
+        if timeinitial==-1000 and np.sum(cut) != 0:             
+            timeinitial = timelast
+            mp=np.mean(imi10,0)+np.mean(imi_mid,0);
+            mpb=mp>0.3*threshold_otsu(mp); 
+            lc=rank.otsu(mp.astype('uint16'), disk(10)); mpb2=mp>0.7*np.mean(lc); 
+            mpb=(mpb+mpb2)>0;
+            mp1=np.sum(mpb[:,40:mp.shape[1]-20],1);
+            ix = np.where(mp1>0)
+            mp0=np.sum(mpb,0)
+            ix0 = np.where(mp0>0)          
+            mpz=np.mean(imi10,1)+np.mean(imi_mid,1)+np.mean(imi,1);
+            mpzb=mpz>1.2*threshold_otsu(mpz)           
+            mpz1=np.sum(mpzb,1)
+            iz = np.where(mpz1>0)     
+            #ix[0][-1]=sz[1];ix[0][0]=0; #for test
+            #ix0[0][-1]=sz[2];ix0[0][0]=0; #for test          
+            #iz[0][-1]=sz[0];iz[0][0]=0; #for test   
+
+            if N_lines_y_axis_cut[0]!=0: 
+                N_lines_y_axis_cut[0]=max(0,max(N_lines_y_axis_cut[0]*(ix[0][0]>0),ix[0][0]-N_lines_y_axis_cut_limit[0])); 
+            if N_lines_y_axis_cut[1]!=0:          
+                N_lines_y_axis_cut[1]=sz[1]-min(sz[1],max((sz[1]-N_lines_y_axis_cut[1])*(ix[0][-1]<sz[1]),ix[0][-1]+N_lines_y_axis_cut_limit[1]))
+
+            if N_lines_x_axis_cut[0]!=0:          
+                N_lines_x_axis_cut[0]=max(0,max(N_lines_x_axis_cut[0]*(ix0[0][0]>0),ix0[0][0]-N_lines_x_axis_cut_limit[0])) 
+            if N_lines_x_axis_cut[1]!=0:          
+                N_lines_x_axis_cut[1]=sz[2]-min(sz[2],max((sz[2]-N_lines_x_axis_cut[1])*(ix0[0][-1]<sz[2]),ix0[0][-1]+N_lines_x_axis_cut_limit[1])) 
+
+            if N_lines_z_axis_cut[0]!=0: 
+                N_lines_z_axis_cut[0]=max(0,max(N_lines_z_axis_cut[0]*(iz[0][0]>0),iz[0][0]-N_lines_z_axis_cut_limit[0])) 
+            if N_lines_z_axis_cut[1]!=0:          
+                N_lines_z_axis_cut[1]=sz[0]-min(sz[0],max((sz[0]-N_lines_z_axis_cut[1])*(iz[0][-1]<sz[1]),iz[0][-1]+N_lines_z_axis_cut_limit[1]))
+
+            #print(N_lines_z_axis_cut,N_lines_y_axis_cut,N_lines_x_axis_cut)
+
+            print('Orginal image volume size',imi.shape)
+
+
+        if imi.shape[0] == 1:
+            continue
+
+        if np.sum(cut) == 0:
+            print('Orginal image volume size - no change',imi.shape);
+        
+        else:
+            # reduce matrix size      
+            imi=imi[N_lines_z_axis_cut[0]:sz[0]-N_lines_z_axis_cut[1],N_lines_y_axis_cut[0]:sz[1]- N_lines_y_axis_cut[1],N_lines_x_axis_cut[0]:sz[2]-N_lines_x_axis_cut[1]]
+
+        if prevX != -1 and prevX != imi.shape[0]:
+            print(imi.shape)
+            continue
+        prevX = imi.shape[0]
+        imarray.append(imi)
+        finalImi = imi
+        
+    if not len(finalImi) or not finalImi.shape[0] or not finalImi.shape[1] or not finalImi.shape[2]:
+        print("Inputted image uses 2d data. Cannot parse into 3d data")
+        exit(1)
+
+    time = timelast - timeinitial; #total time of cine in seconds.
+    if newres!=0:
+        print('voxel size is changed from ', res, 'to voxel size of ', newres)
+    
+    print('Reduced image volume size',np.array(finalImi).shape)
+
+    sh1_og=np.shape(imi_mid);sh1_og=(sh1_og[0]*sh1_og[1]*sh1_og[2])/(1024**2)
+    sh1=np.shape(finalImi);sh1=(sh1[0]*sh1[1]*sh1[2])/(1024**2)
+    imarray1 = np.zeros((1,len(imarray),1,finalImi.shape[0],finalImi.shape[1],finalImi.shape[2]),dtype='uint8')
+    imarray = np.array(imarray)
+    imarray1[0,:,0,:,:,:] = np.asarray(imarray)
+
+    return imarray1, finalRes, time;
+
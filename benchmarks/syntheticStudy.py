@@ -0,0 +1,42 @@
+# Writes synthetic XML/RAW acquisition folders for the benchmarks
+import os
+import numpy as np
+
+XML_TEMPLATE = """<?xml version="1.0"?>
+<Image>
+  <Columns>{M}</Columns>
+  <Rows>{N}</Rows>
+  <Volume>
+    <Geometry>
+      <Layers>
+        <Layer>
+          <RegionLocationMaxz1>{Pm1}</RegionLocationMaxz1>
+          <PhysicalDeltaX>0.05</PhysicalDeltaX>
+          <PhysicalDeltaY>0.04</PhysicalDeltaY>
+          <PhysicalDeltaZ>0.03</PhysicalDeltaZ>
+        </Layer>
+      </Layers>
+    </Geometry>
+  </Volume>
+  <AcquisitionDateTime>{stamp}</AcquisitionDateTime>
+</Image>
+"""
+
+def write_synthetic_study(folder, numFrames=40, shape=(64, 96, 112), frameTime=0.5, scoutFrames=()):
+    # shape is (P, N, M) = (z, y, x). Each frame has a bright block in the middle
+    # surrounded by a dark border, so the auto-crop has something to find.
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(0)
+    P, N, M = shape
+    for t in range(numFrames):
+        p = 1 if t in scoutFrames else P
+        img = np.zeros((p, N, M), dtype=np.uint8)
+        inner = img[p//8:p-p//8 or 1, N//8:N-N//8, M//8:M-M//8]
+        inner[...] = rng.integers(20, 200, size=inner.shape, dtype=np.uint8)
+        seconds = t*frameTime
+        stamp = '20230101%02d%02d%09.6f' % (12, int(seconds//60), seconds % 60)
+        name = os.path.join(folder, 'frame%05d.xml' % t)
+        with open(name, 'w') as f:
+            f.write(XML_TEMPLATE.format(M=M, N=N, Pm1=p-1, stamp=stamp))
+        img.tofile(name[:-3]+'0.raw')
+    return folder
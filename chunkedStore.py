@@ -0,0 +1,172 @@
+import json
+import threading
+import zipfile
+from collections import OrderedDict
+import numpy as np
+
+# Chunked, compressed 4D store. The volume is kept in the viewer's (x, y, z, t)
+# order and split into blocks along all four axes. Each block is a deflated
+# .npy member of a zip file (the same container np.savez_compressed writes),
+# so reading a frame, a slice or one voxel's time series only decompresses
+# the blocks it overlaps.
+
+DEFAULT_CHUNKS = (64, 64, 64, 4)
+META_NAME = 'meta.json'
+
+
+def chunk_name(index):
+    return 'c_%d_%d_%d_%d.npy' % tuple(index)
+
+
+class ChunkedVolumeWriter:
+    # Takes (x, y, z) frames in time order and writes the blocks as soon as a
+    # full run of chunks[3] frames has been buffered
+    def __init__(self, path, shape, pixdim=None, chunks=DEFAULT_CHUNKS, compresslevel=6):
+        self.shape = tuple(int(s) for s in shape)
+        self.chunks = tuple(int(min(c, s)) for c, s in zip(chunks, self.shape))
+        self.zipf = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        meta = {'shape': self.shape, 'chunks': self.chunks, 'dtype': 'uint8',
+                'pixdim': [float(p) for p in pixdim] if pixdim is not None else None}
+        self.zipf.writestr(META_NAME, json.dumps(meta))
+        self.buffer = np.empty(self.shape[0:3] + (self.chunks[3],), dtype=np.uint8)
+        self.buffered = 0
+        self.t = 0
+
+    def add_frame(self, frame):
+        self.buffer[..., self.buffered] = frame
+        self.buffered += 1
+        if self.buffered == self.chunks[3]:
+            self.flush()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        cx, cy, cz, ct = self.chunks
+        for i in range(0, self.shape[0], cx):
+            for j in range(0, self.shape[1], cy):
+                for k in range(0, self.shape[2], cz):
+                    block = np.ascontiguousarray(self.buffer[i:i+cx, j:j+cy, k:k+cz, :self.buffered])
+                    with self.zipf.open(chunk_name((i//cx, j//cy, k//cz, self.t//ct)), 'w', force_zip64=True) as f:
+                        np.lib.format.write_array(f, block, allow_pickle=False)
+        self.t += self.buffered
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.zipf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_chunked_volume(path, shape, pixdim, frames, chunks=DEFAULT_CHUNKS):
+    # frames yields (x, y, z) arrays
+    with ChunkedVolumeWriter(path, shape, pixdim, chunks) as writer:
+        for frame in frames:
+            writer.add_frame(frame)
+    return path
+
+
+class ChunkedVolume:
+    # Read side of the store. Supports numpy basic indexing (ints and slices)
+    # on all four axes and only decodes the blocks the request overlaps.
+    # Recently decoded blocks are kept in a small LRU cache.
+    def __init__(self, path, cacheSize=64):
+        self.path = path
+        self.zipf = zipfile.ZipFile(path, 'r')
+        meta = json.loads(self.zipf.read(META_NAME))
+        self.shape = tuple(meta['shape'])
+        self.chunks = tuple(meta['chunks'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.ndim = 4
+        self.header = {'pixdim': np.array(meta['pixdim']) if meta['pixdim'] is not None else None}
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock() # the viewer and background readers share the zip and cache
+
+    def chunk(self, index):
+        index = tuple(index)
+        with self.lock:
+            if index in self.cache:
+                self.cache.move_to_end(index)
+                return self.cache[index]
+            with self.zipf.open(chunk_name(index)) as f:
+                block = np.lib.format.read_array(f, allow_pickle=False)
+            self.cache[index] = block
+            if len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+            return block
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),)*(4-len(key)+1) + key[i+1:]
+        key = key + (slice(None),)*(4-len(key))
+
+        # index list per axis, and the contiguous range that covers it
+        indices = []
+        squeeze = []
+        for axis, k in enumerate(key):
+            if isinstance(k, slice):
+                indices.append(np.arange(*k.indices(self.shape[axis])))
+            else:
+                k = int(k)
+                if k < 0:
+                    k += self.shape[axis]
+                if not 0 <= k < self.shape[axis]:
+                    raise IndexError('index %d is out of bounds for axis %d with size %d' % (k, axis, self.shape[axis]))
+                indices.append(np.array([k]))
+                squeeze.append(axis)
+        if any(len(idx) == 0 for idx in indices):
+            return np.empty([len(idx) for axis, idx in enumerate(indices) if axis not in squeeze], dtype=self.dtype)
+        lo = [int(idx.min()) for idx in indices]
+        hi = [int(idx.max())+1 for idx in indices]
+
+        out = np.empty([h-l for l, h in zip(lo, hi)], dtype=self.dtype)
+        ranges = [range(l//c, (h-1)//c+1) for l, h, c in zip(lo, hi, self.chunks)]
+        for ci in ranges[0]:
+            for cj in ranges[1]:
+                for ck in ranges[2]:
+                    for cl in ranges[3]:
+                        block = self.chunk((ci, cj, ck, cl))
+                        src = []
+                        dst = []
+                        for axis, c in enumerate((ci, cj, ck, cl)):
+                            start = max(lo[axis], c*self.chunks[axis])
+                            stop = min(hi[axis], (c+1)*self.chunks[axis])
+                            src.append(slice(start-c*self.chunks[axis], stop-c*self.chunks[axis]))
+                            dst.append(slice(start-lo[axis], stop-lo[axis]))
+                        out[tuple(dst)] = block[tuple(src)]
+
+        # strided or reversed slices are picked out of the covering range
+        picks = tuple(idx-l if len(idx) != h-l or (len(idx) > 1 and idx[1] < idx[0]) else slice(None)
+                      for idx, l, h in zip(indices, lo, hi))
+        for axis, pick in enumerate(picks):
+            if not isinstance(pick, slice):
+                out = np.take(out, pick, axis=axis)
+        if squeeze:
+            out = out.reshape([s for axis, s in enumerate(out.shape) if axis not in squeeze])
+        return out
+
+    def frame(self, t):
+        return self[:, :, :, t]
+
+    def slice(self, axis, index, t):
+        key = [slice(None)]*3 + [t]
+        key[axis] = index
+        return self[tuple(key)]
+
+    def voxel_series(self, x, y, z):
+        return self[x, y, z, :]
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+    def close(self):
+        self.zipf.close()
@@ -0,0 +1,352 @@
+import os
+import re
+import gzip
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+import numpy as np
+import nibabel as nib
+import utils as ut
+
+
+MAPPED_FRAMES = 8
+INCOMPLETE_WAIT = 10.0 # seconds a live frame may stay incomplete before it is dropped
+RESCAN_POLLS = 10 # polls without the next numbered frame before the folder is listed again
+
+
+class LazyVolume4D:
+    # 4D cine in read3D order (t, z, y, x) built on memory-mapped .0.raw views.
+    # Frame shapes come from the XML headers, so building the volume reads no
+    # pixel data. Cropping only changes the views, and indexing only pulls in
+    # the pages of the frames (and the part of each frame) that are touched.
+    # Every mapping holds a file descriptor, so only the last mappedFrames
+    # views are kept; a long cine neither runs into the descriptor limit nor
+    # keeps its pages mapped behind the viewer's frame cache.
+    def __init__(self, xmlFiles, cuts=None, mappedFrames=MAPPED_FRAMES):
+        headers = ut.read_xml_headers(xmlFiles)
+        keep, outShape = ut.select_frames(headers, cuts, xmlFiles)
+        self.xmlFiles = [xmlFiles[i] for i in keep]
+        self.shapes = [headers[i][0:3] for i in keep]
+        self.times = [headers[i][4] for i in keep]
+        self.res = headers[keep[0]][3] if len(keep) else None
+        self.cuts = cuts
+        self.views = OrderedDict()
+        self.mappedFrames = mappedFrames
+        self.lock = threading.Lock() # guards views
+
+        self.shape = (len(keep),) + (outShape if outShape is not None else (0, 0, 0))
+        self.dtype = np.dtype(np.uint8)
+        self.ndim = 4
+
+    def __len__(self):
+        return self.shape[0]
+
+    def frame(self, t):
+        # cropped zero-copy (z, y, x) view of frame t; the file stays mapped
+        # while the view is in use, or is one of the last few mapped
+        with self.lock:
+            img = self.views.get(t)
+            if img is not None:
+                self.views.move_to_end(t)
+                return img
+        img = ut.mmap_raw_frame(self.xmlFiles[t], self.shapes[t])
+        if self.cuts is not None:
+            img = ut.crop_frame(img, self.cuts)
+        with self.lock:
+            self.views[t] = img
+            while len(self.views) > self.mappedFrames:
+                self.views.popitem(last=False)
+        return img
+
+    def crop(self, cuts):
+        # New lazy volume over the same files with different crop limits
+        return LazyVolume4D(self.xmlFiles, cuts, self.mappedFrames)
+
+    def close(self):
+        with self.lock:
+            self.views.clear()
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        tKey, spatial = key[0], key[1:]
+        if isinstance(tKey, (int, np.integer)):
+            return self.frame(int(tKey))[spatial]
+        frames = range(self.shape[0])[tKey]
+        out = np.empty((len(frames),) + self.frame(0)[spatial].shape, dtype=self.dtype)
+        for i, t in enumerate(frames):
+            out[i] = self.frame(t)[spatial]
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+
+class FrameVolume4D:
+    # Base for cines in the viewer's (x, y, z, t) order that are stored frame
+    # by frame. Subclasses provide shape and frame(t), an (x, y, z) array;
+    # indexing then only touches the frames the key selects.
+    dtype = np.dtype(np.uint8)
+    ndim = 4
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),)*(4-len(key)+1) + key[i+1:]
+        key = key + (slice(None),)*(4-len(key))
+        spatial, tKey = key[0:3], key[3]
+        if isinstance(tKey, (int, np.integer)):
+            return self.frame(range(self.shape[3])[tKey])[spatial]
+        frames = range(self.shape[3])[tKey]
+        out = np.empty(self.frame(frames[0])[spatial].shape + (len(frames),), dtype=self.dtype)
+        for i, t in enumerate(frames):
+            out[..., i] = self.frame(t)[spatial]
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+
+class GrowingVolume4D(FrameVolume4D):
+    # Cine that frames can be appended to while it is open. Each frame is kept
+    # as its own array, so appending never copies or reallocates the frames
+    # already in the volume.
+    def __init__(self, res=None):
+        self.frames = []
+        self.times = []
+        self.res = res
+        self.frameShape = None
+
+    @property
+    def shape(self):
+        return (self.frameShape or (0, 0, 0)) + (len(self.frames),)
+
+    @property
+    def header(self):
+        # same pixdim layout xml2nifti writes: [dims, voxel dims, frame time, 0, 0, 0]
+        frameTime = (self.times[-1]-self.times[0])/(len(self.times)-1) if len(self.times) > 1 else 0.
+        res = self.res if self.res is not None else [1., 1., 1.]
+        return {'pixdim': np.array([4., res[0], res[1], res[2], frameTime, 0., 0., 0.])}
+
+    def append(self, frame, time):
+        # frame is an (x, y, z) array
+        if self.frameShape is None:
+            self.frameShape = frame.shape
+        self.frames.append(frame)
+        self.times.append(time)
+
+    def frame(self, t):
+        return self.frames[t]
+
+
+FRAME_CACHE_BYTES = 512*1024*1024
+
+
+class FrameCache4D(FrameVolume4D):
+    # Cine whose frames are loaded on demand by loadFrame(t) and kept in an LRU
+    # cache of at most cacheBytes, so showing the first image only costs one
+    # frame however long the cine is. prefetch(t) loads the frames at
+    # prefetchOffsets around t on a background thread while the current one
+    # is on screen. close() stops that thread, drops the cache and calls
+    # closeFiles to release what loadFrame reads from.
+    def __init__(self, loadFrame, numFrames, frameShape, header=None, cacheBytes=FRAME_CACHE_BYTES, prefetchOffsets=(1, -1, 2, -2), closeFiles=None):
+        self.loadFrame = loadFrame
+        self.closeFiles = closeFiles
+        self.numFrames = numFrames
+        self.frameShape = tuple(int(s) for s in frameShape)
+        self.header = header if header is not None else {'pixdim': None}
+        self.prefetchOffsets = prefetchOffsets
+        frameBytes = max(1, int(np.prod(self.frameShape)))
+        self.cacheFrames = max(len(prefetchOffsets)+2, cacheBytes // frameBytes)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock() # guards cache and pending
+        self.loadLock = threading.Lock() # loaders share file handles, one load at a time
+        self.pending = set()
+        self.pool = None
+
+    @property
+    def shape(self):
+        return self.frameShape + (self.numFrames,)
+
+    def cached(self, t):
+        with self.lock:
+            if t in self.cache:
+                self.cache.move_to_end(t)
+                return self.cache[t]
+        return None
+
+    def frame(self, t):
+        frame = self.cached(t)
+        if frame is not None:
+            return frame
+        with self.loadLock:
+            # the prefetch thread may have loaded it while this one waited
+            frame = self.cached(t)
+            if frame is not None:
+                return frame
+            frame = self.loadFrame(t)
+        with self.lock:
+            self.cache[t] = frame
+            while len(self.cache) > self.cacheFrames:
+                self.cache.popitem(last=False)
+        return frame
+
+    def prefetch(self, t):
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=1)
+        for offset in self.prefetchOffsets:
+            n = t + offset
+            with self.lock:
+                if not 0 <= n < self.numFrames or n in self.cache or n in self.pending:
+                    continue
+                self.pending.add(n)
+            self.pool.submit(self.prefetch_frame, n)
+
+    def prefetch_frame(self, t):
+        try:
+            self.frame(t)
+        finally:
+            with self.lock:
+                self.pending.discard(t)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        # a prefetch already reading finishes before its files go
+        with self.loadLock:
+            if self.closeFiles is not None:
+                self.closeFiles()
+                self.closeFiles = None
+        with self.lock:
+            self.cache.clear()
+
+    @classmethod
+    def from_nifti(cls, path, cacheBytes=FRAME_CACHE_BYTES):
+        # Frames are sliced from the image's dataobj, so only the bytes of the
+        # requested time point are read (and, for .nii.gz, decompressed). The
+        # file stays open, owned by the volume until close(), so stepping
+        # forward continues from the previous frame; gzip has to start over to
+        # go backwards, so .nii.gz only prefetches ahead. Returns the nibabel
+        # image and the volume.
+        fileobj = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+        img = nib.Nifti1Image.from_stream(fileobj)
+        proxy = img.dataobj
+        def loadFrame(t):
+            return np.asarray(proxy[..., t]).astype(np.uint8, copy=False)
+        offsets = (1, 2, 3) if path.endswith('.gz') else (1, -1, 2, -2)
+        return img, cls(loadFrame, img.shape[3], img.shape[0:3], img.header, cacheBytes, offsets, fileobj.close)
+
+    @classmethod
+    def from_xml_folder(cls, folder, cut=[[-1,-1,5,5],[-1,-1,25,5],[-1,-1,5,5]], cacheBytes=FRAME_CACHE_BYTES, progress=None):
+        # Viewer access to an XML/RAW acquisition without converting it: frames
+        # are cropped like xml2nifti crops them, have the same temporal minimum
+        # background subtracted, and are copied out of their memory-mapped .raw
+        # when first shown. Finding the background reads every frame once, up
+        # front; progress(message, done, total) is called after each.
+        plan = ut.plan_read3D(folder, cut)
+        xmlnamedir, headers, keep, cuts, outShape, res, time = plan
+        background = ut.temporal_minimum(ut.report_frames(ut.iter_frames(plan), progress, 'Finding background', len(keep)))
+        lazy = LazyVolume4D([xmlnamedir[i] for i in keep], cuts)
+        def loadFrame(t):
+            # frame >= background everywhere, so the uint8 subtraction cannot wrap
+            return np.subtract(lazy.frame(t), background).T
+        header = {'pixdim': np.array([4., res[0], res[1], res[2], time/(len(keep)+1), 0., 0., 0.])}
+        return cls(loadFrame, len(keep), outShape[::-1], header, cacheBytes, closeFiles=lazy.close)
+
+
+def next_frame_name(xmlname):
+    # Name of the frame exported after xmlname when the names are numbered
+    # (frame00041.xml -> frame00042.xml), None otherwise
+    folder, name = os.path.split(xmlname)
+    match = re.match(r'(.*?)(\d+)\.xml$', name)
+    if match is None:
+        return None
+    number = match.group(2)
+    return os.path.join(folder, match.group(1) + str(int(number)+1).zfill(len(number)) + '.xml')
+
+
+class AcquisitionWatcher:
+    # Follows an acquisition folder the scanner is still exporting into, taking
+    # frames in file name order and appending them to a GrowingVolume4D. After
+    # the first frame a poll only checks whether the next numbered file exists;
+    # the folder is listed again only every rescanPolls polls without it (a gap
+    # in the numbering, or names without numbers), so polling costs the same
+    # however long the cine gets. A frame is taken once its .raw payload has
+    # the size its header announces. One that is still incomplete after
+    # incompleteWait seconds is dropped and reported, with the session's
+    # running count, so a frame the export gave up on does not hold up the rest.
+    def __init__(self, folder, incompleteWait=INCOMPLETE_WAIT, rescanPolls=RESCAN_POLLS):
+        self.folder = folder
+        self.volume = GrowingVolume4D()
+        self.incompleteWait = incompleteWait
+        self.rescanPolls = rescanPolls
+        self.xmlFiles = [] # every frame taken or dropped, in order
+        self.dropped = [] # (index in xmlFiles, reason)
+        self.pending = [] # found but not taken yet, in order
+        self.missedPolls = 0
+        self.waiting = None # (xmlname, when it was first found incomplete)
+
+    def find_frames(self):
+        # Fills self.pending with the next frames, if there are any
+        if self.pending:
+            return self.pending
+        expected = next_frame_name(self.xmlFiles[-1]) if self.xmlFiles else None
+        if expected is not None and os.path.exists(expected):
+            self.pending = [expected]
+            self.missedPolls = 0
+        elif not self.xmlFiles or self.missedPolls >= self.rescanPolls:
+            last = self.xmlFiles[-1] if self.xmlFiles else ''
+            self.pending = [f for f in ut.list_xml_frames(self.folder) if f > last]
+            self.missedPolls = 0
+        else:
+            self.missedPolls += 1
+        return self.pending
+
+    def drop(self, xmlname, reason):
+        self.pending.remove(xmlname)
+        self.dropped.append((len(self.xmlFiles), reason))
+        self.xmlFiles.append(xmlname)
+        print('Dropped', os.path.basename(xmlname), '-', reason, '(%d of %d frames so far)' % (len(self.dropped), len(self.xmlFiles)))
+
+    def poll(self):
+        # Returns the number of frames appended to self.volume
+        added = 0
+        while self.find_frames():
+            xmlname = self.pending[0]
+            try:
+                M, N, P, voxel, time, dateStr = ut.read_xml_header(xmlname)
+                size = os.path.getsize(ut.raw_filename(xmlname))
+                incomplete = None if size >= M*N*P else 'raw file has %d bytes, header needs %d' % (size, M*N*P)
+            except (ET.ParseError, OSError, TypeError, ZeroDivisionError) as e:
+                incomplete = 'header or raw file unreadable (%s)' % e
+            if incomplete is not None:
+                if self.waiting is None or self.waiting[0] != xmlname:
+                    self.waiting = (xmlname, monotonic())
+                if monotonic() - self.waiting[1] < self.incompleteWait:
+                    # still being written; later frames wait for it to keep the order
+                    break
+                self.drop(xmlname, incomplete + ' after %g s' % self.incompleteWait)
+                continue
+            shape = (M, N, P)
+            if P == 1:
+                # scout frames and frames of a different size are left out, as in read3D
+                self.drop(xmlname, 'single plane (2D scout)')
+                continue
+            if self.volume.frameShape is not None and self.volume.frameShape != shape:
+                self.drop(xmlname, 'shape %s differs from %s' % (shape, self.volume.frameShape))
+                continue
+            frame = np.fromfile(ut.raw_filename(xmlname), dtype=np.uint8, count=M*N*P).reshape((P, N, M))
+            if self.volume.res is None:
+                self.volume.res = voxel
+            self.volume.append(frame.T, time)
+            self.pending.remove(xmlname)
+            self.xmlFiles.append(xmlname)
+            added += 1
+        return added
@@ -0,0 +1,122 @@
+import os
+import time
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+import utils as ut
+import chunkedStore as cs
+import lazyVolume as lv
+
+# Worker threads for opening and converting studies and for the passes over
+# the whole cine (VOI, TIC), so the Qt event loop keeps running. Workers
+# report through signals only; the controller owns the data and all widgets.
+# progress(message, done, total) is handed to the long running functions as
+# their callback, and once cancel() has been called it raises LoadCancelled
+# to stop them at the next frame.
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+class TaskWorker(QThread):
+    # Runs task(progress) and emits its return value through done. A result
+    # that arrives after cancel() is handed to discard instead, which closes
+    # whatever the task opened.
+    progressed = pyqtSignal(str, int, int)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    done = pyqtSignal(object)
+
+    def __init__(self, task, discard=None, parent=None):
+        super().__init__(parent)
+        self.task = task
+        self.discard = discard or (lambda result: None)
+        self.cancelRequested = False
+
+    def cancel(self):
+        self.cancelRequested = True
+
+    def progress(self, message, done, total):
+        if self.cancelRequested:
+            raise LoadCancelled()
+        self.progressed.emit(message, done, total)
+
+    def run(self):
+        try:
+            result = self.task(self.progress)
+        except LoadCancelled:
+            self.cleanup()
+            self.cancelled.emit()
+        except (Exception, SystemExit) as e:
+            # read3D exits on 2D data; that must not take the GUI down with it
+            self.cleanup()
+            self.failed.emit(str(e) if not isinstance(e, SystemExit) else 'Inputted image uses 2d data. Cannot parse into 3d data')
+        else:
+            if self.cancelRequested:
+                self.discard(result)
+                self.cancelled.emit()
+            else:
+                self.done.emit(result)
+
+    def cleanup(self):
+        pass
+
+
+class ConvertWorker(TaskWorker):
+    # Runs xml2nifti and emits the output path; a cancelled or failed
+    # conversion leaves no partial file (an older output of the same folder is
+    # left alone)
+    def __init__(self, folder, destination, parent=None, **options):
+        super().__init__(self.convert, parent=parent)
+        self.folder = folder
+        self.destination = destination
+        self.options = options
+        self.outputPath = ut.xml2nifti_output_path(folder, destination, options.get('fmt', 'nii.gz'))
+
+    def convert(self, progress):
+        self.startTime = time.time()
+        return ut.xml2nifti(self.folder, self.destination, progress=progress, **self.options)
+
+    def cleanup(self):
+        if os.path.exists(self.outputPath) and os.path.getmtime(self.outputPath) >= self.startTime:
+            os.remove(self.outputPath)
+
+
+def open_study(path, progress):
+    # Opens the study at path for the viewer. Returns (nibImg, dataNibImg);
+    # nibImg is None for .mat input, which has no header.
+    if path.endswith(".mat"):
+        # Only rf_data_all_fund is read, one plane at a time, and each plane
+        # goes through the envelope stage as soon as it is off disk
+        planes = ut.iter_mat_cell(path, "rf_data_all_fund", rows=2, cols=5)
+        # envelope of all RF lines of a plane in one batched FFT, planes in parallel
+        data = ut.rf_planes_to_bmode(ut.report_frames(planes, progress, 'Reading RF plane', 2*5))
+        # data = 20*np.log10(abs(hilbert(input["rf_data_all_fund"])))
+        data = np.array(data)
+        return None, np.reshape(data, (data.shape[0], data.shape[1], data.shape[2], 1))
+
+    progress('Opening', 0, 1)
+    if path.endswith(".npz"):
+        # chunked store: slices and TIC windows are decoded on demand, never as a whole
+        nibImg = cs.ChunkedVolume(path)
+        data = nibImg
+    elif path.endswith(".xml"):
+        # any frame of an XML/RAW acquisition opens the whole folder, one frame at a time
+        nibImg = lv.FrameCache4D.from_xml_folder(os.path.dirname(path), progress=progress)
+        data = nibImg
+    elif path.endswith(".gz"):
+        # Only the first frame is decompressed here so the slices can be
+        # shown at once; the frames ahead are decompressed in the
+        # background, and memory stays within the frame cache's budget.
+        # Every frame is there from the start, so TIC and VOI always see
+        # the whole cine.
+        nibImg, data = lv.FrameCache4D.from_nifti(path)
+    else:
+        # uint8 straight from the file (memory-mapped for .nii), read-only
+        nibImg, data = ut.load_nifti_uint8(path)
+    return nibImg, data
+
+def close_study(study):
+    # Releases what open_study opened: frame cache threads and file handles
+    if hasattr(study[1], 'close'):
+        study[1].close()
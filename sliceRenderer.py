@@ -0,0 +1,243 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Display orientation of the three planes of an (x, y, z[, c]) volume, the
+# result of the flipud/rot90/fliplr chains the controller used to apply:
+#   axial    (axis 2): rows y, columns x, volume[:, :, z].T
+#   sagittal (axis 0): rows y, columns z, volume[x, :, :]
+#   coronal  (axis 1): rows z, columns x, volume[:, y, :].T
+# DISPLAY_ORDER[axis] is the transpose that puts the plane index first and the
+# display rows and columns after it, so layout[index] of the transposed copy
+# is a C-contiguous plane QImage can use as it is.
+DISPLAY_ORDER = {0: (0, 1, 2), 1: (1, 2, 0), 2: (2, 1, 0)}
+
+LAYOUT_BYTES = 256*1024*1024
+
+
+def orient_plane(plane, axis):
+    # display orientation of a plane already cut out along axis (a view)
+    return plane if axis == 0 else plane.swapaxes(0, 1)
+
+
+def display_plane(volume, axis, index):
+    # display-ordered view of one plane of an (x, y, z[, c]) volume
+    key = [slice(None)]*3
+    key[axis] = index
+    return orient_plane(volume[tuple(key)], axis)
+
+
+# The ROI and parametric-map overlays are scalar label volumes (0 is empty),
+# coloured only when a plane is shown: a 256 entry lookup table of ARGB32
+# pixels (bytes B, G, R, A) turns the label plane into the QImage data. A new
+# colour map or alpha is a new table, not a pass over the VOI.
+# The ROI volume counts the ROI points drawn on each voxel, so an ROI can be
+# painted or taken away on its own without touching the others; any count
+# shows as the ROI colour.
+ROI_LABEL = 1
+ROI_COLORS = np.zeros((256, 3), dtype=np.uint8)
+ROI_COLORS[ROI_LABEL:] = (0, 0, 255) # red, as B, G, R
+
+
+def label_volume(shape):
+    # (x, y, z) uint8 label volume, one byte a voxel; argb_plane writes a new
+    # plane from it anyway, so it needs no display-friendly storage order
+    return np.zeros(tuple(shape[0:3]), dtype=np.uint8)
+
+
+def paint_labels(labels, points, count=1):
+    # adds count to the label of each (x, y, z) point; a point listed twice is
+    # counted twice, so painting and then unpainting the same points with
+    # count=-1 restores the volume exactly
+    points = np.asarray(points, dtype=np.intp).reshape(-1, 3)
+    np.add.at(labels, tuple(points.T), np.uint8(count % 256))
+
+
+def colormap_colors(colors):
+    # B, G, R of labels 1..255 from a matplotlib colormap's RGB list (0 to 1)
+    colors = np.asarray(colors)
+    table = np.zeros((256, 3), dtype=np.uint8)
+    table[1:] = colors[(np.arange(255)*(len(colors)-1)) // 254, 2::-1]*255
+    return table
+
+
+def quantize_labels(values, vmin, vmax):
+    # parameter values to labels 1..255 over [vmin, vmax] for colormap_colors;
+    # NaN (a voxel paramap left without a fit) gets label 0, no colour
+    values = np.asarray(values, dtype=np.float64)
+    scale = 254/(vmax-vmin) if vmax > vmin else 0
+    labels = (1 + np.clip(np.nan_to_num(values-vmin)*scale, 0, 254)).astype(np.uint8)
+    labels[np.isnan(values)] = 0
+    return labels
+
+
+def overlay_lut(colors, alpha):
+    # 256 ARGB32 pixels for the B, G, R colours of each label; label 0 stays transparent
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[1:, 0:3] = colors[1:]
+    lut[1:, 3] = alpha
+    return lut
+
+
+def argb_plane(labels, lut, axis, index):
+    # C-contiguous display-ordered ARGB32 plane of a label volume; one 32-bit
+    # pixel is looked up per label, several times faster than lut[plane]
+    plane = display_plane(labels, axis, index)
+    return np.take(lut.view(np.uint32).ravel(), plane).view(np.uint8).reshape(plane.shape + (4,))
+
+
+def display_layout(frame, axis):
+    # C-contiguous copy of an (x, y, z[, c]) frame in DISPLAY_ORDER[axis]
+    return np.ascontiguousarray(np.transpose(frame, DISPLAY_ORDER[axis] + tuple(range(3, frame.ndim))))
+
+
+class PlaneRenderer:
+    # Hands out display-ordered, C-contiguous uint8 planes from a
+    # VolumePyramid. Moving the crosshair cuts planes of one axis out of the
+    # same frame over and over, so the second request for a (frame, level,
+    # axis) builds that frame's layout for the axis once, and every later
+    # plane of it is a zero-copy view. A one-off request (a frame change, or
+    # playback) is a single copy straight out of the volume, since building a
+    # layout would cost more than it saves. Layouts are kept in an LRU of at
+    # most layoutBytes.
+    def __init__(self, pyramid, layoutBytes=LAYOUT_BYTES):
+        self.pyramid = pyramid
+        self.layoutBytes = layoutBytes
+        self.layouts = OrderedDict()
+        self.bytes = 0
+        self.asked = set()
+
+    def plane(self, axis, index, t, displaySize):
+        level, f = self.pyramid.level(axis, t, displaySize)
+        key = (t, f, axis)
+        layout = self.layouts.get(key)
+        if layout is None and key in self.asked:
+            layout = self.build(key, level)
+        if layout is not None:
+            self.layouts.move_to_end(key)
+            return layout[min(index // f, layout.shape[0]-1)]
+        if len(self.asked) > 64:
+            self.asked.clear()
+        self.asked.add(key)
+        return self.cut(axis, index, t, displaySize)
+
+    def cut(self, axis, index, t, displaySize):
+        # One uint8 plane copied straight out of the volume or its pyramid
+        # level; float volumes (.mat input) are cast as the viewer always did.
+        # Touches no renderer state, so PlanePrefetcher calls it from its own
+        # thread.
+        level, f = self.pyramid.level(axis, t, displaySize)
+        if level is None:
+            # only the plane is read, which for chunked and lazily loaded
+            # volumes is much less than the whole frame
+            volumeKey = [slice(None)]*3 + [t]
+            volumeKey[axis] = index
+            return np.require(orient_plane(self.pyramid.volume[tuple(volumeKey)], axis), np.uint8, 'C')
+        return np.require(display_plane(level, axis, min(index // f, level.shape[axis]-1)), np.uint8, 'C')
+
+    def build(self, key, level):
+        t, f, axis = key
+        frame = level if level is not None else np.asarray(self.pyramid.volume[:, :, :, t])
+        if frame.nbytes > self.layoutBytes:
+            return None
+        layout = np.require(display_layout(frame, axis), np.uint8, 'C')
+        self.layouts[key] = layout
+        self.bytes += layout.nbytes
+        while self.bytes > self.layoutBytes:
+            old = self.layouts.popitem(last=False)[1]
+            self.bytes -= old.nbytes
+        return layout
+
+
+CINE_AHEAD = 4
+
+
+class PlanePrefetcher:
+    # Cuts the image planes of the next frames of cine playback on a
+    # background thread, so a playback step only turns ready arrays into
+    # pixmaps. The controller names the frames and views it expects to show
+    # next (frame, axis, index, displaySize) and takes them as it shows them;
+    # planes nobody asks for any more are dropped, so after a dropped frame
+    # the worker moves on instead of catching up.
+    def __init__(self, planes):
+        self.planes = planes
+        self.wanted = [] # keys in the order they will be shown
+        self.ready = {}
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def set_wanted(self, frames, views):
+        wanted = [(t,) + tuple(view) for t in frames for view in views]
+        with self.lock:
+            self.wanted = wanted
+            self.ready = {key: plane for key, plane in self.ready.items() if key in wanted}
+        self.event.set()
+
+    def take(self, t, axis, index, displaySize):
+        # the prefetched plane, or None if the worker has not got to it
+        key = (t, axis, index, displaySize)
+        with self.lock:
+            if key in self.wanted:
+                self.wanted.remove(key)
+            return self.ready.pop(key, None)
+
+    def next_key(self):
+        with self.lock:
+            for key in self.wanted:
+                if key not in self.ready:
+                    return key
+        return None
+
+    def run(self):
+        while not self.stopped:
+            self.event.clear()
+            key = self.next_key()
+            if key is None:
+                self.event.wait()
+                continue
+            t, axis, index, displaySize = key
+            plane = self.planes.cut(axis, index, t, displaySize)
+            with self.lock:
+                if key in self.wanted:
+                    self.ready[key] = plane
+
+    def close(self):
+        self.stopped = True
+        self.event.set()
+
+
+RENDER_CACHE_BYTES = 128*1024*1024
+
+
+class RenderCache:
+    # LRU of finished renders (the controller keeps the scaled mask and image
+    # QPixmaps of a plane), keyed by everything the render depends on and
+    # bounded by the byte size the caller gives for each entry. Anything that
+    # changes what a key would show has to change the key, so entries are
+    # never stale, only unused until they age out.
+    def __init__(self, maxBytes=RENDER_CACHE_BYTES):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, nbytes):
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, nbytes)
+        self.bytes += nbytes
+        while self.bytes > self.maxBytes and len(self.entries) > 1:
+            self.bytes -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
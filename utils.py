@@ -1,5 +1,5 @@
 from __future__ import print_function
-import os, glob
+import os, glob, json, gzip
 import numpy as np
 from numpy.lib.stride_tricks import as_strided as ast
 import scipy.misc
@@ -12,6 +12,7 @@ from skimage.morphology import opening, disk,closing,ball,erosion, dilation
 from skimage.filters import gaussian, threshold_otsu, sobel, rank
 from sklearn.metrics import mean_squared_error
 import nibabel as nib
+import chunkedStore as cs
 
 def paramap(img, xmask, ymask, zmask, res, time, tf, compressfactor, windSize_x, windSize_y, windSize_z):
     print('*************************** Starting Parameteric Map *****************************')
@@ -96,14 +97,109 @@ def paramap(img, xmask, ymask, zmask, res, time, tf, compressfactor, windSize_x,
     print('Paraloop ended:')#;print(str(datetime.now()));
     return final_map;
 
-def generate_TIC(window, mask, times, compression, voxelscale):
-    TICtime=times;TIC=[]; 
+def rf_to_bmode(rf, axis=0):
+    # Log-compressed envelope, 20*log10(|hilbert(rf)|), of every RF line of a
+    # plane at once: one batched FFT along axis instead of a hilbert call per
+    # column. Works in single precision (float32 in, complex64 transforms) and
+    # returns a float32 array the shape of rf.
+    from scipy import fft as sp_fft
+    rf = np.asarray(rf, dtype=np.float32)
+    N = rf.shape[axis]
+    spectrum = sp_fft.fft(rf, axis=axis)
+    # analytic signal: keep DC (and Nyquist), double the positive frequencies
+    h = np.zeros(N, dtype=np.float32)
+    h[0] = 1
+    if N % 2 == 0:
+        h[N//2] = 1
+        h[1:N//2] = 2
+    else:
+        h[1:(N+1)//2] = 2
+    shape = [1]*rf.ndim
+    shape[axis] = N
+    spectrum *= h.reshape(shape)
+    envelope = np.abs(sp_fft.ifft(spectrum, axis=axis, overwrite_x=True))
+    with np.errstate(divide='ignore'):
+        np.log10(envelope, out=envelope)
+    envelope *= 20
+    return envelope
+
+def rf_planes_to_bmode(planes, workers=None):
+    # rf_to_bmode over a sequence of planes on a thread pool; the FFTs release
+    # the GIL, so planes are converted in parallel. planes may be a generator:
+    # it is only advanced as workers free up, so at most 2*workers RF planes
+    # are held at once. Results keep the input order.
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
+    workers = workers or os.cpu_count() or 1
+    out = []
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for plane in planes:
+            pending.append(pool.submit(rf_to_bmode, plane))
+            if len(pending) >= 2*workers:
+                out.append(pending.popleft().result())
+        while pending:
+            out.append(pending.popleft().result())
+    return out
+
+def iter_mat_cell(filename, name, rows=None, cols=None):
+    # Yields the arrays of cell array variable name of a .mat file, row by row
+    # (cell{1,1}, cell{1,2}, ...), as float32 in MATLAB orientation. For v7.3
+    # (HDF5) files only that variable is touched and each array is read from
+    # disk when it is yielded. rows/cols limit the part of the cell read.
+    try:
+        import h5py
+        f = h5py.File(filename, 'r')
+    except (ImportError, OSError):
+        # pre-v7.3 files are not HDF5 and need no h5py; scipy can still skip
+        # the other variables
+        from scipy.io import loadmat
+        cell = loadmat(filename, variable_names=[name])[name]
+        for i in range(cell.shape[0] if rows is None else rows):
+            for j in range(cell.shape[1] if cols is None else cols):
+                yield np.asarray(cell[i, j], dtype=np.float32)
+        return
+    with f:
+        # HDF5 keeps MATLAB arrays transposed: the cell is stored (cols, rows)
+        # as object references, each referenced matrix as (cols, rows) too
+        refs = f[name]
+        for i in range(refs.shape[1] if rows is None else rows):
+            for j in range(refs.shape[0] if cols is None else cols):
+                dataset = f[refs[j, i]]
+                yield dataset.astype(np.float32)[()].T
+
+def max_over_time(volume, points, progress=None):
+    # Temporal maximum at each (x, y, z) point, read frame by frame so lazy or
+    # chunked volumes load every frame once rather than once per point.
+    # progress(message, done, total) is called after every frame
+    idx = tuple(np.array(points, dtype=int).reshape(-1, 3).T)
+    peak = np.zeros(len(idx[0]), dtype=volume.dtype)
+    for t in range(volume.shape[3]):
+        np.maximum(peak, volume[:,:,:,t][idx], out=peak)
+        if progress is not None:
+            progress('Finding the VOI in frame', t+1, volume.shape[3])
+    return peak
+
+def tic_mask_box(mask):
+    # Bounding box of the mask and the mask cropped to it. Only the box is read
+    # from each volume, which keeps chunked or lazily loaded windows from
+    # decoding whole frames
     bool_mask = np.array(mask, dtype=bool)
-    for t in range(0,window.shape[3]):
-        tmpwin = window[:,:,:,t];      
-        TIC.append(np.exp(tmpwin[bool_mask]/compression).mean()*voxelscale);
-        # TIC.append(np.around((tmpwin[bool_mask]/compression).mean()*voxelscale, decimals=1)); 
-    TICz = np.array([TICtime,TIC]).astype('float64'); TICz = TICz.transpose();
+    nz = np.nonzero(bool_mask)
+    if len(nz[0]):
+        box = tuple(slice(int(i.min()), int(i.max())+1) for i in nz)
+        bool_mask = bool_mask[box]
+    else:
+        box = (slice(None),)*3
+    return box, bool_mask
+
+def tic_value(window, t, box, bool_mask, compression, voxelscale):
+    # Un-normalised TIC sample of time point t
+    tmpwin = window[box[0],box[1],box[2],t];
+    return np.exp(tmpwin[bool_mask]/compression).mean()*voxelscale;
+
+def normalize_TIC(times, TIC):
+    TICz = np.array([times,TIC]).astype('float64'); TICz = TICz.transpose();
     TICz[:,1]=TICz[:,1]-np.mean(TICz[0:2,1]);#Substract noise in TIC before contrast.
     if TICz[np.nan_to_num(TICz)<0].any():#make the smallest number in the TIC 0.
         TICz[:,1]=TICz[:,1]+np.abs(np.min(TICz[:,1]));
@@ -111,6 +207,21 @@ def generate_TIC(window, mask, times, compression, voxelscale):
         TICz[:,1]=TICz[:,1]-np.min(TICz[:,1]);
     return TICz;
 
+def tic_samples(window, mask, compression, voxelscale, progress=None):
+    # Un-normalised TIC samples of every time point; progress(message, done,
+    # total) is called after each one
+    TIC=[];
+    box, bool_mask = tic_mask_box(mask)
+    for t in range(0,window.shape[3]):
+        TIC.append(tic_value(window, t, box, bool_mask, compression, voxelscale));
+        # TIC.append(np.around((tmpwin[bool_mask]/compression).mean()*voxelscale, decimals=1)); 
+        if progress is not None:
+            progress('Computing TIC, frame', t+1, window.shape[3])
+    return TIC
+
+def generate_TIC(window, mask, times, compression, voxelscale, progress=None):
+    return normalize_TIC(times, tic_samples(window, mask, compression, voxelscale, progress));
+
 def data_fit(TIC,model,normalizer, timeconst):
     #Fitting function
     #Returns the parameters scaled by normalizer
@@ -143,80 +254,208 @@ def bolus_lognormal(x, auc, mu, sigma, t0):
     curve_fit=(auc/(2.5066*sigma*(x-t0)))*np.exp(-1*(((np.log(x-t0)-mu)**2)/(2*sigma*sigma))) 
     return np.nan_to_num(curve_fit)
 
-def read_xmlraw_image_func(filename):    
+def raw_filename(filename):
     # get .raw filename
-    filename_raw=filename[0:len(filename)-3]+('0.raw');
-    fff = open(filename_raw,'rb')
-
-    # parsing xml file
-    tree = ET.parse(filename);
-    root = tree.getroot();
-
-    # ADD MAX FRAMES TO LOAD
-    numfiles = len(root); # Comment this out if using max num frames on next lines
-
-    for i in range(0, numfiles):
-        if  root[i].tag=='Columns':
-          M=int(root[i].text);
-        if  root[i].tag=='Rows':
-          N=int(root[i].text);  
-        if  (root[i].find('Geometry') == None) == False:
-          geometry = root[i].find('Geometry')
-          if not geometry:
-              continue
-          layer = geometry.find('Layers')
-          if not layer:
-              continue
-          layer = layer.find('Layer')
-          if not layer:
-              continue
-          regionLocationMaxz1 = layer.find('RegionLocationMaxz1')
-          physicalDeltaX = layer.find('PhysicalDeltaX')
-          physicalDeltaY = layer.find('PhysicalDeltaY')
-          physicalDeltaZ = layer.find('PhysicalDeltaZ')
-          if regionLocationMaxz1:
-              P=int(regionLocationMaxz1.text)+1
-          if physicalDeltaX:
-              voxelX = float(physicalDeltaX.text)
-          if physicalDeltaY:
-              voxelY = float(physicalDeltaY.text)
-          if physicalDeltaZ:
-              voxelZ = float(physicalDeltaZ.text)
-          try:
-              voxel=[float(physicalDeltaX.text)*10, float(physicalDeltaY.text)*10, float(physicalDeltaZ.text)*10] # cm to mm
-              P=int(regionLocationMaxz1.text)+1
-          except:
-              continue
-          
-        if root[i].tag=='AcquisitionDateTime':
-          tval=root[i].text;
-          dateStr=tval[0:4]+'-'+tval[4:6]+'-'+tval[6:8]+' '+tval[8:10]+':'+tval[10:12]+':'+tval[12:len(tval)];
-          time=float(tval[12:len(tval)])+float(tval[10:12])*60+float(tval[8:10])*3600;
-    
-    x = np.fromfile(fff,dtype=np.uint8)
-
-    try:
-        P
-    except NameError:
-        P = int(x.size / M / N)
+    return filename[0:len(filename)-3]+('0.raw')
+
+def read_xml_header(filename):
+    # Returns the frame dims (M columns, N rows, P planes), voxel size in mm,
+    # acquisition time in seconds and date string without touching the .raw payload.
+    # The XML is streamed and parsing stops as soon as every field has been seen.
+    filename_raw=raw_filename(filename);
+    M = N = P = voxel = time = dateStr = None
+
+    path = [] # tags of the open elements above the current one
+    layer = {}
+    for event, elem in ET.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            path.append(elem.tag)
+            continue
+        path.pop()
+        if len(path) == 1:
+            # direct children of the root
+            if elem.tag=='Columns':
+                M=int(elem.text);
+            elif elem.tag=='Rows':
+                N=int(elem.text);
+            elif elem.tag=='AcquisitionDateTime':
+                tval=elem.text;
+                dateStr=tval[0:4]+'-'+tval[4:6]+'-'+tval[6:8]+' '+tval[8:10]+':'+tval[10:12]+':'+tval[12:len(tval)];
+                time=float(tval[12:len(tval)])+float(tval[10:12])*60+float(tval[8:10])*3600;
+        elif len(path) == 5 and path[2:5] == ['Geometry', 'Layers', 'Layer'] and not layer.get('done'):
+            layer[elem.tag] = elem.text
+        elif len(path) == 4 and path[2:4] == ['Geometry', 'Layers'] and elem.tag == 'Layer' and not layer.get('done'):
+            # only the first Layer of a Geometry counts
+            layer['done'] = True
+            try:
+                voxel=[float(layer['PhysicalDeltaX'])*10, float(layer['PhysicalDeltaY'])*10, float(layer['PhysicalDeltaZ'])*10] # cm to mm
+                P=int(layer['RegionLocationMaxz1'])+1
+            except (KeyError, TypeError, ValueError):
+                pass
+        elif len(path) == 2 and elem.tag == 'Geometry':
+            layer = {}
+        if M is not None and N is not None and P is not None and time is not None:
+            break
+
+    if P is None:
+        P = int(os.path.getsize(filename_raw) / M / N) if os.path.exists(filename_raw) else 0
         voxel=[(P-1)*10, (P-1)*10, (P-1)*10]
 
+    return M, N, P, voxel, time, dateStr
+
+HEADER_INDEX_NAME = '.headerIndex.json'
+
+def file_signature(filename):
+    # a missing file gets a signature of its own, so its frame can be
+    # reported by validate_frames instead of failing here
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return [None, None]
+    return [st.st_mtime_ns, st.st_size]
+
+def read_xml_headers(xmlFiles):
+    # read_xml_header for a list of frames, backed by a sidecar index in each
+    # acquisition folder. An entry is reused while the mtime and size of both the
+    # .xml and the .0.raw match, so a folder that has been seen before needs no
+    # XML parsing at all.
+    indexes = {}
+    changed = set()
+    headers = []
+    for xmlname in xmlFiles:
+        folder, name = os.path.split(os.path.abspath(xmlname))
+        if folder not in indexes:
+            indexes[folder] = {}
+            try:
+                with open(os.path.join(folder, HEADER_INDEX_NAME)) as f:
+                    indexes[folder] = json.load(f)
+            except (OSError, ValueError):
+                pass
+        signature = file_signature(xmlname) + file_signature(raw_filename(xmlname))
+        entry = indexes[folder].get(name)
+        if entry is None or entry['signature'] != signature:
+            entry = {'signature': signature, 'header': list(read_xml_header(xmlname))}
+            indexes[folder][name] = entry
+            changed.add(folder)
+        M, N, P, voxel, time, dateStr = entry['header']
+        headers.append((M, N, P, voxel, time, dateStr))
+
+    for folder in changed:
+        indexPath = os.path.join(folder, HEADER_INDEX_NAME)
+        try:
+            with open(indexPath+'.tmp', 'w') as f:
+                json.dump(indexes[folder], f)
+            os.replace(indexPath+'.tmp', indexPath)
+        except OSError:
+            print('Could not write header index for', folder)
+    return headers
+
+def mmap_raw_frame(filename, shapes):
+    # Zero-copy (P,N,M) uint8 view of the .raw payload. Pages are only read from
+    # disk when the view (or a crop of it) is actually accessed.
+    M, N, P = shapes
+    return np.memmap(raw_filename(filename), dtype=np.uint8, mode='r', shape=(P,N,M))
+
+def read_xmlraw_image_func(filename, mmap=False):
+    M, N, P, voxel, time, dateStr = read_xml_header(filename)
     shapes = (M,N,P);
-    img = np.reshape(x, (P,N,M))
+
+    if mmap:
+        img = mmap_raw_frame(filename, shapes)
+    else:
+        x = np.fromfile(raw_filename(filename),dtype=np.uint8)
+        img = np.reshape(x, (P,N,M))
 
     return img, voxel, time, shapes, dateStr
 
-def read3D(data, newres, cut):#=[[-1,-1,5,5],[-1,-1,25,5],[-1,-1,5,5]]):
-    # cut=[[10,15,5,5],[50,5,20,4],[15,15,5,5]] #Size reduce with user selected caps
-    # cut=[[-1,-1,5,5],[-1,-1,5,5],[-1,-1,5,5]] #Automatic size reduce
-    # cut=[[0,0,5,5],[0,0,20,4],[0,0,5,5]] # Keep original size      
- 
+# Pixel budget of the (y, x) projection the auto-crop thresholds, rank filter
+# included, when a preview is asked for (cropBudget=AUTOCROP_PREVIEW_PIXELS).
+# Larger frames are previewed at a coarser stride, which is faster but can
+# move a crop edge by a pixel, so the exact full resolution crop is the
+# default.
+AUTOCROP_PREVIEW_PIXELS = 256*256
+
+def preview_step(shape, budget):
+    # smallest stride that brings the (y, x) projection of a (z, y, x) frame
+    # under budget pixels; budget=None keeps full resolution
+    step = 1
+    if budget:
+        while -(-shape[1]//step)*-(-shape[2]//step) > budget:
+            step += 1
+    return step
+
+def compute_cut_limits(imi, imi10, imi_mid, cut, step=1):
+    # Works out how many lines to remove from each side of every axis, from the
+    # mean projections of a few frames. imi is the first frame of the cine.
+    # step > 1 runs the thresholds on every step-th voxel along each axis, and
+    # the bounds found are mapped back to full-resolution line numbers.
     N_lines_z_axis_cut=cut[0][0:2] #10,10   
     N_lines_z_axis_cut_limit=cut[0][2:4]#5,5
     N_lines_y_axis_cut=cut[1][0:2]#50,5  
     N_lines_y_axis_cut_limit=cut[1][2:4]#20,5
     N_lines_x_axis_cut=cut[2][0:2]##[15, 15]    
     N_lines_x_axis_cut_limit=cut[2][2:4]#5,5
+    sz=imi.shape
+    if step > 1:
+        imi, imi10, imi_mid = [f[::step,::step,::step] for f in (imi, imi10, imi_mid)]
+
+    mp=np.mean(imi10,0)+np.mean(imi_mid,0);
+    mpb=mp>0.3*threshold_otsu(mp); 
+    lc=rank.otsu(mp.astype('uint16'), disk(max(1, int(round(10/step))))); mpb2=mp>0.7*np.mean(lc); 
+    mpb=(mpb+mpb2)>0;
+    mp1=np.sum(mpb[:,40//step:mp.shape[1]-20//step],1);
+    ix = np.where(mp1>0)
+    mp0=np.sum(mpb,0)
+    ix0 = np.where(mp0>0)          
+    mpz=np.mean(imi10,1)+np.mean(imi_mid,1)+np.mean(imi,1);
+    mpzb=mpz>1.2*threshold_otsu(mpz)           
+    mpz1=np.sum(mpzb,1)
+    iz = np.where(mpz1>0)     
+    #ix[0][-1]=sz[1];ix[0][0]=0; #for test
+    #ix0[0][-1]=sz[2];ix0[0][0]=0; #for test          
+    #iz[0][-1]=sz[0];iz[0][0]=0; #for test   
+
+    # first and last lines with signal at full resolution. A preview line stands
+    # for the lines between it and its neighbours, so the box is widened to keep
+    # anything the preview could have skipped over.
+    ylo, yhi = max(0, (ix[0][0]-1)*step+1), min(ix[0][-1]*step+step-1, sz[1]-1)
+    xlo, xhi = max(0, (ix0[0][0]-1)*step+1), min(ix0[0][-1]*step+step-1, sz[2]-1)
+    zlo, zhi = max(0, (iz[0][0]-1)*step+1), min(iz[0][-1]*step+step-1, sz[0]-1)
+
+    if N_lines_y_axis_cut[0]!=0: 
+        N_lines_y_axis_cut[0]=max(0,max(N_lines_y_axis_cut[0]*(ylo>0),ylo-N_lines_y_axis_cut_limit[0])); 
+    if N_lines_y_axis_cut[1]!=0:          
+        N_lines_y_axis_cut[1]=sz[1]-min(sz[1],max((sz[1]-N_lines_y_axis_cut[1])*(yhi<sz[1]),yhi+N_lines_y_axis_cut_limit[1]))
+
+    if N_lines_x_axis_cut[0]!=0:          
+        N_lines_x_axis_cut[0]=max(0,max(N_lines_x_axis_cut[0]*(xlo>0),xlo-N_lines_x_axis_cut_limit[0])) 
+    if N_lines_x_axis_cut[1]!=0:          
+        N_lines_x_axis_cut[1]=sz[2]-min(sz[2],max((sz[2]-N_lines_x_axis_cut[1])*(xhi<sz[2]),xhi+N_lines_x_axis_cut_limit[1])) 
+
+    if N_lines_z_axis_cut[0]!=0: 
+        N_lines_z_axis_cut[0]=max(0,max(N_lines_z_axis_cut[0]*(zlo>0),zlo-N_lines_z_axis_cut_limit[0])) 
+    if N_lines_z_axis_cut[1]!=0:          
+        N_lines_z_axis_cut[1]=sz[0]-min(sz[0],max((sz[0]-N_lines_z_axis_cut[1])*(zhi<sz[1]),zhi+N_lines_z_axis_cut_limit[1]))
+
+    #print(N_lines_z_axis_cut,N_lines_y_axis_cut,N_lines_x_axis_cut)
+    return N_lines_z_axis_cut, N_lines_y_axis_cut, N_lines_x_axis_cut
+
+def crop_frame(imi, cuts):
+    # cuts=None keeps the original size
+    if cuts is None:
+        print('Orginal image volume size - no change',imi.shape);
+        return imi
+    N_lines_z_axis_cut, N_lines_y_axis_cut, N_lines_x_axis_cut = cuts
+    sz=imi.shape
+    return imi[N_lines_z_axis_cut[0]:sz[0]-N_lines_z_axis_cut[1],N_lines_y_axis_cut[0]:sz[1]- N_lines_y_axis_cut[1],N_lines_x_axis_cut[0]:sz[2]-N_lines_x_axis_cut[1]]
+
+def cropped_shape(sz, cuts):
+    # Shape crop_frame gives a (P,N,M) frame, worked out without reading it
+    if cuts is None:
+        return tuple(sz)
+    return tuple(len(range(sz[k])[cuts[k][0]:sz[k]-cuts[k][1]]) for k in range(3))
+
+def list_xml_frames(data):
     xmldir = data+('/*.xml');
     xmlnamedir = sorted(glob.glob(xmldir));
 
@@ -224,130 +463,365 @@ def read3D(data, newres, cut):#=[[-1,-1,5,5],[-1,-1,25,5],[-1,-1,5,5]]):
     for file in xmlnamedir:
         if (len(file) >= 10 and file[-10:] == ".mevis.xml"):
             xmlnamedir.remove(file)
+    return xmlnamedir
+
+def validate_frames(headers, cuts, xmlFiles=None):
+    # Picks the frames read3D keeps from header dims and raw file sizes alone,
+    # so the payload of a rejected frame is never read. Frames with a single z
+    # plane (2D scouts) are dropped, as are frames whose cropped shape differs
+    # from the previous kept frame and, when xmlFiles is given, frames whose
+    # .raw is missing or shorter than the header says. Returns the kept
+    # indices, the cropped frame shape and a list of (index, reason) drops.
+    keep = []
+    dropped = []
+    outShape = None
+    prevX = -1
+    for i, header in enumerate(headers):
+        M, N, P = header[0:3]
+        if P == 1:
+            dropped.append((i, 'single plane (2D scout)'))
+            continue
+        if xmlFiles is not None:
+            try:
+                size = os.path.getsize(raw_filename(xmlFiles[i]))
+            except OSError:
+                dropped.append((i, 'raw file missing'))
+                continue
+            if size < M*N*P:
+                dropped.append((i, 'raw file has %d bytes, header needs %d' % (size, M*N*P)))
+                continue
+        shape = cropped_shape((P,N,M), cuts)
+        if (prevX != -1 and prevX != shape[0]) or (outShape is not None and shape != outShape):
+            dropped.append((i, 'shape %s differs from %s' % (shape, outShape)))
+            continue
+        prevX = shape[0]
+        outShape = shape
+        keep.append(i)
+    return keep, outShape, dropped
+
+def report_dropped_frames(dropped, numFrames, xmlFiles=None):
+    if not len(dropped):
+        return
+    print('Dropped', len(dropped), 'of', numFrames, 'frames:')
+    for i, reason in dropped:
+        print('  ', os.path.basename(xmlFiles[i]) if xmlFiles is not None else i, '-', reason)
+
+def select_frames(headers, cuts, xmlFiles=None):
+    keep, outShape, dropped = validate_frames(headers, cuts, xmlFiles)
+    report_dropped_frames(dropped, len(headers), xmlFiles)
+    return keep, outShape
+
+def read_cut_frame(xmlname, shapes, cuts):
+    # Reads and crops one frame. Top level so it can be sent to worker processes.
+    # Only the pages inside the crop are read when the mapped view is copied out
+    return np.ascontiguousarray(crop_frame(mmap_raw_frame(xmlname, shapes), cuts))
+
+def plan_read3D(data, cut, cropBudget=None):
+    # Everything read3D needs before it touches a payload: the frame files and
+    # their headers, which frames are kept, the crop limits, the cropped frame
+    # shape, the voxel size and the cine length in seconds. The auto-crop works
+    # on a preview of at most cropBudget pixels per projection if one is
+    # given, and on the full projections otherwise.
+    xmlnamedir = list_xml_frames(data)
 
     if not len(xmlnamedir):
         print("No XML files found in folder")
         return
 
-        
-    imarray = []#np.zeros((len(xmlnamedir),shapes[2],shapes[1],shapes[0]),dtype='uint8')
-    timeinitial = -1000; ix=-1;
-    imi_mid, res, timelast, shapes, dateStr = read_xmlraw_image_func(xmlnamedir[np.uint16(len(xmlnamedir)/2)]); 
-    imi10, res, timelast, shapes, dateStr = read_xmlraw_image_func(xmlnamedir[10]); 
-    imi_mid, res, timelast, shapes, dateStr = read_xmlraw_image_func(xmlnamedir[1]);
-
+    # Frame dims, voxel size and times all come from the XML headers, so the
+    # kept frames and the output size are known before any payload is read
+    headers = read_xml_headers(xmlnamedir)
+    timeinitial = -1000;
+    res = headers[1][3]
+    timelast = headers[-1][4]
     finalRes = res
-    
-    finalImi = []
-    prevX = -1
-    for xmlname in xmlnamedir:
-        #imarray[0,xmlnamedir.index(xmlname),0,:,:,:], res, timelast, shapes, dateStr = read_xmlraw_image_func(xmlname)
-        imi, res, timelast, shapes, dateStr = read_xmlraw_image_func(xmlname); 
-        sz=imi.shape
-
-        if timeinitial==-1000 and np.sum(cut) != 0:             
-            timeinitial = timelast
-            mp=np.mean(imi10,0)+np.mean(imi_mid,0);
-            mpb=mp>0.3*threshold_otsu(mp); 
-            lc=rank.otsu(mp.astype('uint16'), disk(10)); mpb2=mp>0.7*np.mean(lc); 
-            mpb=(mpb+mpb2)>0;
-            mp1=np.sum(mpb[:,40:mp.shape[1]-20],1);
-            ix = np.where(mp1>0)
-            mp0=np.sum(mpb,0)
-            ix0 = np.where(mp0>0)          
-            mpz=np.mean(imi10,1)+np.mean(imi_mid,1)+np.mean(imi,1);
-            mpzb=mpz>1.2*threshold_otsu(mpz)           
-            mpz1=np.sum(mpzb,1)
-            iz = np.where(mpz1>0)     
-            #ix[0][-1]=sz[1];ix[0][0]=0; #for test
-            #ix0[0][-1]=sz[2];ix0[0][0]=0; #for test          
-            #iz[0][-1]=sz[0];iz[0][0]=0; #for test   
-
-            if N_lines_y_axis_cut[0]!=0: 
-                N_lines_y_axis_cut[0]=max(0,max(N_lines_y_axis_cut[0]*(ix[0][0]>0),ix[0][0]-N_lines_y_axis_cut_limit[0])); 
-            if N_lines_y_axis_cut[1]!=0:          
-                N_lines_y_axis_cut[1]=sz[1]-min(sz[1],max((sz[1]-N_lines_y_axis_cut[1])*(ix[0][-1]<sz[1]),ix[0][-1]+N_lines_y_axis_cut_limit[1]))
-
-            if N_lines_x_axis_cut[0]!=0:          
-                N_lines_x_axis_cut[0]=max(0,max(N_lines_x_axis_cut[0]*(ix0[0][0]>0),ix0[0][0]-N_lines_x_axis_cut_limit[0])) 
-            if N_lines_x_axis_cut[1]!=0:          
-                N_lines_x_axis_cut[1]=sz[2]-min(sz[2],max((sz[2]-N_lines_x_axis_cut[1])*(ix0[0][-1]<sz[2]),ix0[0][-1]+N_lines_x_axis_cut_limit[1])) 
-
-            if N_lines_z_axis_cut[0]!=0: 
-                N_lines_z_axis_cut[0]=max(0,max(N_lines_z_axis_cut[0]*(iz[0][0]>0),iz[0][0]-N_lines_z_axis_cut_limit[0])) 
-            if N_lines_z_axis_cut[1]!=0:          
-                N_lines_z_axis_cut[1]=sz[0]-min(sz[0],max((sz[0]-N_lines_z_axis_cut[1])*(iz[0][-1]<sz[1]),iz[0][-1]+N_lines_z_axis_cut_limit[1]))
-
-            #print(N_lines_z_axis_cut,N_lines_y_axis_cut,N_lines_x_axis_cut)
-
-            print('Orginal image volume size',imi.shape)
-
-
-        if imi.shape[0] == 1:
-            continue
 
-        if np.sum(cut) == 0:
-            print('Orginal image volume size - no change',imi.shape);
-        
-        else:
-            # reduce matrix size      
-            imi=imi[N_lines_z_axis_cut[0]:sz[0]-N_lines_z_axis_cut[1],N_lines_y_axis_cut[0]:sz[1]- N_lines_y_axis_cut[1],N_lines_x_axis_cut[0]:sz[2]-N_lines_x_axis_cut[1]]
+    cuts = None
+    if np.sum(cut) != 0:
+        timeinitial = headers[0][4]
+        # Sample frames for the auto-crop are mapped, not copied
+        imi = mmap_raw_frame(xmlnamedir[0], headers[0][0:3])
+        i10 = min(10, len(xmlnamedir)-1)
+        imi10 = mmap_raw_frame(xmlnamedir[i10], headers[i10][0:3])
+        imi_mid = mmap_raw_frame(xmlnamedir[1], headers[1][0:3])
+        cuts = compute_cut_limits(imi, imi10, imi_mid, cut, preview_step(imi.shape, cropBudget))
+        print('Orginal image volume size',imi.shape)
 
-        if prevX != -1 and prevX != imi.shape[0]:
-            print(imi.shape)
-            continue
-        prevX = imi.shape[0]
-        imarray.append(imi)
-        finalImi = imi
-        
-    if not len(finalImi) or not finalImi.shape[0] or not finalImi.shape[1] or not finalImi.shape[2]:
+    keep, outShape = select_frames(headers, cuts, xmlnamedir)
+
+    if not len(keep) or not outShape[0] or not outShape[1] or not outShape[2]:
         print("Inputted image uses 2d data. Cannot parse into 3d data")
         exit(1)
 
     time = timelast - timeinitial; #total time of cine in seconds.
+    return xmlnamedir, headers, keep, cuts, outShape, finalRes, time
+
+def iter_frames(plan, workers=1):
+    # Cropped, memory-mapped (z, y, x) views of the kept frames, in order.
+    # workers > 1 reads and crops them in a pool of worker processes instead,
+    # at most 2*workers frames ahead of the consumer, so streaming stays
+    # bounded in memory
+    xmlnamedir, headers, keep, cuts = plan[0:4]
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from collections import deque
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for i in keep:
+                pending.append(pool.submit(read_cut_frame, xmlnamedir[i], headers[i][0:3], cuts))
+                if len(pending) >= 2*workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        return
+    for i in keep:
+        yield crop_frame(mmap_raw_frame(xmlnamedir[i], headers[i][0:3]), cuts)
+
+def read3D(data, newres, cut, workers=1, cropBudget=None, progress=None):#=[[-1,-1,5,5],[-1,-1,25,5],[-1,-1,5,5]]):
+    # cut=[[10,15,5,5],[50,5,20,4],[15,15,5,5]] #Size reduce with user selected caps
+    # cut=[[-1,-1,5,5],[-1,-1,5,5],[-1,-1,5,5]] #Automatic size reduce
+    # cut=[[0,0,5,5],[0,0,20,4],[0,0,5,5]] # Keep original size      
+    # workers > 1 reads and crops the frames across a pool of worker processes
+    # cropBudget opts in to an auto-crop preview of at most that many pixels
+    # (None, the default, crops from the full resolution projections)
+    # progress(message, done, total) is called after every frame
+
+    start_time = datetime.now()
+    plan = plan_read3D(data, cut, cropBudget)
+    if plan is None:
+        return
+    xmlnamedir, headers, keep, cuts, outShape, finalRes, time = plan
+
+    # Each kept frame is read once, straight into its slot of the output
+    imarray1 = np.empty((1,len(keep),1,outShape[0],outShape[1],outShape[2]),dtype='uint8')
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = pool.map(read_cut_frame, [xmlnamedir[i] for i in keep], [headers[i][0:3] for i in keep], [cuts]*len(keep), chunksize=max(1, int(len(keep)/(4*workers))))
+            # Frames come back in acquisition order
+            for j, imi in enumerate(frames):
+                imarray1[0,j,0] = imi
+                if progress is not None:
+                    progress('Reading frames', j+1, len(keep))
+    else:
+        for j, imi in enumerate(iter_frames(plan)):
+            imarray1[0,j,0] = imi
+            if progress is not None:
+                progress('Reading frames', j+1, len(keep))
+
+    elapsed = (datetime.now() - start_time).total_seconds()
+    print('Read', len(keep), 'frames in', round(elapsed, 2), 's (', round(len(keep)/max(elapsed, 1e-6), 1), 'frames/s, workers:', workers, ')')
+
     if newres!=0:
-        print('voxel size is changed from ', res, 'to voxel size of ', newres)
+        print('voxel size is changed from ', finalRes, 'to voxel size of ', newres)
     
-    print('Reduced image volume size',np.array(finalImi).shape)
-
-    sh1_og=np.shape(imi_mid);sh1_og=(sh1_og[0]*sh1_og[1]*sh1_og[2])/(1024**2)
-    sh1=np.shape(finalImi);sh1=(sh1[0]*sh1[1]*sh1[2])/(1024**2)
-    imarray1 = np.zeros((1,len(imarray),1,finalImi.shape[0],finalImi.shape[1],finalImi.shape[2]),dtype='uint8')
-    imarray = np.array(imarray)
-    imarray1[0,:,0,:,:,:] = np.asarray(imarray)
+    print('Reduced image volume size',outShape)
 
     return imarray1, finalRes, time;
 
-def xml2nifti(folderPath, fileDestination):
+class ParallelGzipWriter:
+    # File-like writer producing a multi-member gzip stream. Input is cut into
+    # fixed-size blocks that are deflated on a thread pool (zlib releases the GIL)
+    # and written back in order. Concatenated gzip members are a standard gzip
+    # stream, so gzip, nibabel and zcat all read the result as one file.
+    def __init__(self, path, compresslevel=6, threads=None, blockSize=4*1024*1024):
+        from concurrent.futures import ThreadPoolExecutor
+        self.f = open(path, 'wb')
+        self.compresslevel = compresslevel
+        self.threads = threads or os.cpu_count() or 1
+        self.blockSize = blockSize
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = []
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.blockSize:
+            self.submit(bytes(self.buffer[:self.blockSize]))
+            del self.buffer[:self.blockSize]
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.pool.submit(gzip.compress, block, self.compresslevel, mtime=0))
+        # bound the blocks in flight so memory stays a few blocks per thread
+        while len(self.pending) > 2*self.threads:
+            self.f.write(self.pending.pop(0).result())
+
+    def close(self):
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        for future in self.pending:
+            self.f.write(future.result())
+        self.pending = []
+        self.pool.shutdown()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def write_nifti_frames(outputPath, shape, pixdim, frames, compresslevel=None, compressThreads=1):
+    # Writes a uint8 NIfTI-1 file frame by frame. shape is the NIfTI (x, y, z, t)
+    # shape and frames yields (z, y, x) C-ordered arrays, whose bytes are already
+    # the Fortran-ordered (x, y, z) block NIfTI stores for one time point.
+    # .nii.gz output uses nibabel's default level unless compresslevel is given,
+    # and is deflated block-parallel when compressThreads > 1.
+    header = nib.Nifti1Header()
+    header.set_data_dtype(np.uint8)
+    header.set_data_shape(shape)
+    header.set_qform(np.eye(4), code='unknown')
+    header.set_sform(np.eye(4), code='aligned')
+    header['pixdim'] = pixdim
+
+    if compresslevel is None:
+        compresslevel = nib.openers.Opener.default_compresslevel
+    if not outputPath.endswith('.gz'):
+        f = open(outputPath, 'wb')
+    elif compressThreads > 1:
+        f = ParallelGzipWriter(outputPath, compresslevel, compressThreads)
+    else:
+        f = gzip.open(outputPath, 'wb', compresslevel=compresslevel)
+    with f:
+        header.write_to(f)
+        for frame in frames:
+            f.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+
+def write_volume_frames(outputPath, shape, pixdim, frames, fmt='nii.gz', compresslevel=None, compressThreads=1):
+    # frames yields (z, y, x) arrays; shape is the (x, y, z, t) output shape
+    if fmt == 'chunked':
+        cs.write_chunked_volume(outputPath, shape, pixdim, (frame.T for frame in frames))
+    else:
+        write_nifti_frames(outputPath, shape, pixdim, frames, compresslevel, compressThreads)
+
+# file extension written for each xml2nifti output format
+OUTPUT_EXTENSIONS = {'nii.gz': '.nii.gz', 'nii': '.nii', 'chunked': '.chunks.npz'}
+
+def load_nifti_uint8(path):
+    # Loads a 4D .nii study without the float64 get_fdata() round trip.
+    # Unscaled uint8 data is memory-mapped as stored; other files fall back to
+    # get_fdata() cast to uint8 as before. The array is returned read-only so
+    # the viewer and the analysis can share it. (.nii.gz studies are opened
+    # frame by frame with lazyVolume.FrameCache4D.from_nifti.)
+    img = nib.load(path, mmap='r')
+    proxy = img.dataobj
+    if img.get_data_dtype() == np.uint8 and getattr(proxy, 'slope', 1.) == 1. and getattr(proxy, 'inter', 0.) == 0.:
+        data = np.asanyarray(proxy)
+    else:
+        data = img.get_fdata().astype(np.uint8)
+    data.flags.writeable = False
+    return img, data
+
+BACKGROUND_CHUNK_BYTES = 8*1024*1024
+
+def subtract_background(volume, axis=1, background=None, chunkBytes=BACKGROUND_CHUNK_BYTES):
+    # In-place, saturating uint8 background subtraction along the time axis.
+    # background defaults to the temporal minimum, which is accumulated into a
+    # single frame-sized array. The volume is then processed in chunks of
+    # whole time points of at most chunkBytes, so the only temporaries are one
+    # frame and one chunk. Works on any writable uint8 array, e.g. read3D
+    # output (axis=1) or a loaded (x, y, z, t) cine (axis=3). Returns the
+    # background used.
+    index = [slice(None)]*volume.ndim
+    def frames(start, stop):
+        index[axis] = slice(start, stop)
+        return volume[tuple(index)]
+
+    if background is None:
+        background = frames(0, 1).copy()
+        for t in range(1, volume.shape[axis]):
+            np.minimum(background, frames(t, t+1), out=background)
+    else:
+        background = np.expand_dims(background, axis)
+    step = max(1, chunkBytes // max(1, background.nbytes))
+    scratch = None
+    for start in range(0, volume.shape[axis], step):
+        block = frames(start, start+step)
+        if scratch is None or scratch.shape != block.shape:
+            scratch = np.empty(block.shape, dtype=volume.dtype)
+        # clamp the background to the data so the subtraction cannot wrap
+        np.minimum(block, background, out=scratch)
+        np.subtract(block, scratch, out=block)
+    return background.squeeze(axis)
+
+
+def xml2nifti_output_path(folderPath, fileDestination, fmt='nii.gz'):
+    # the output is named after the acquisition folder
+    path = os.path.normpath(folderPath)
+    splitpath = path.split(os.sep)
+    name = splitpath[-1]
+    return os.path.join(fileDestination, str(name+OUTPUT_EXTENSIONS[fmt]))
+
+def temporal_minimum(frames):
+    # Elementwise minimum of the frames, holding one frame at a time
+    background = None
+    for imi in frames:
+        if background is None:
+            background = np.array(imi)
+        else:
+            np.minimum(background, imi, out=background)
+    return background
+
+def report_frames(frames, progress, message, total):
+    # passes frames through, calling progress(message, done, total) after each
+    for i, frame in enumerate(frames):
+        yield frame
+        if progress is not None:
+            progress(message, i+1, total)
+
+def xml2nifti(folderPath, fileDestination, streaming=False, fmt='nii.gz', compresslevel=None, compressThreads=1, cropBudget=None, workers=1, progress=None):
+    # streaming=True never holds the whole study in memory: one pass over the
+    # frames finds the temporal minimum, a second writes the background
+    # subtracted frames to the file one at a time
+    # fmt is 'nii.gz', 'nii' (uncompressed) or 'chunked' (a chunkedStore volume).
+    # compresslevel picks the gzip level (1 is fastest) and compressThreads > 1
+    # deflates the .nii.gz in parallel blocks.
+    # cropBudget runs the auto-crop on a preview of at most that many pixels
+    # per projection (see plan_read3D); None crops from full resolution.
+    # workers > 1 reads the frames in that many worker processes (read3D,
+    # iter_frames).
+    # progress(message, done, total) is called after every frame read or
+    # written; an exception raised from it stops the conversion.
     print('Started xml2nii:')
     print(folderPath)
     print(str(datetime.now()))
 
-    path = os.path.normpath(folderPath)
-    splitpath = path.split(os.sep)
-    name = splitpath[-1]
+    outputPath = xml2nifti_output_path(folderPath, fileDestination, fmt)
+
+    if streaming:
+        plan = plan_read3D(folderPath, [[-1,-1,5,5],[-1,-1,25,5],[-1,-1,5,5]], cropBudget)
+        xmlnamedir, headers, keep, cuts, outShape, orgres, time = plan
+        timeconst = time/(len(keep)+1)
+
+        background = temporal_minimum(report_frames(iter_frames(plan, workers), progress, 'Finding background', len(keep)))
+        print('Done temporal minimum:')
+        print(str(datetime.now()))
+
+        # frame >= background everywhere, so the uint8 subtraction cannot wrap
+        cleaned = report_frames((np.subtract(imi, background) for imi in iter_frames(plan, workers)), progress, 'Writing frames', len(keep))
+        shape = (outShape[2], outShape[1], outShape[0], len(keep))
+        write_volume_frames(outputPath, shape, [4., orgres[0], orgres[1], orgres[2], timeconst, 0., 0., 0.], cleaned, fmt, compresslevel, compressThreads)
+        print('Saved cleaned up 4D:')
+        print(str(datetime.now()))
+        return outputPath
 
     # Read data
     # For clarification about magic array, see read3D function
-    imarray_org, orgres, time = read3D(folderPath, 0, [[-1,-1,5,5],[-1,-1,25,5],[-1,-1,5,5]])
+    imarray_org, orgres, time = read3D(folderPath, 0, [[-1,-1,5,5],[-1,-1,25,5],[-1,-1,5,5]], workers=workers, cropBudget=cropBudget, progress=progress)
     timeconst = time/(imarray_org.shape[1]+1)
     print('Done 3D to 4D:')
     print(str(datetime.now()))
 
-    imarray_tosub = np.min(imarray_org[:,:,:,:,:,:],axis=1)
-    imarray_org = (imarray_org - imarray_tosub).astype('int16')
-    del imarray_tosub   
-    imarray_org[imarray_org < 0] = 0
-    imarray_org = imarray_org.astype('uint8')
-    imarray_org2 = np.squeeze(imarray_org)
-    imarray_org2 = imarray_org2.swapaxes(0,3)
-    imarray_org2 = imarray_org2.swapaxes(1,2)
+    # Background removal happens in place on the uint8 study, without the
+    # full-size int16 temporaries
+    subtract_background(imarray_org, axis=1)
     print('Saving cleaned up 4D:')
     print(str(datetime.now()))
 
-    affine = np.eye(4)
-    niiarray = nib.Nifti1Image(imarray_org2.astype('uint8'), affine)
-    niiarray.header['pixdim'] = [4., orgres[0], orgres[1], orgres[2], timeconst, 0., 0., 0.]
-    outputPath = os.path.join(fileDestination, str(name+'.nii.gz'))
-    nib.save(niiarray, outputPath)
+    # Frames go to the writer as they are; each (z, y, x) frame already has the
+    # byte order of one NIfTI time point, so no swapaxes/astype copies are needed
+    shape = (imarray_org.shape[5], imarray_org.shape[4], imarray_org.shape[3], imarray_org.shape[1])
+    write_volume_frames(outputPath, shape, [4., orgres[0], orgres[1], orgres[2], timeconst, 0., 0., 0.], report_frames(imarray_org[0,:,0], progress, 'Writing frames', imarray_org.shape[1]), fmt, compresslevel, compressThreads)
     return outputPath
\ No newline at end of file
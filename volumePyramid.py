@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Downsampled copies of an (x, y, z, t) volume for the slice views. A 331x311
+# label cannot show more than ~331 voxels across, so cutting a plane out of a
+# 600 voxel wide frame and letting QPixmap.scaled drop three rows out of four
+# is wasted work on every crosshair move. Each level halves the previous one
+# (2x2x2 block mean), and holds 1/8 of its voxels, so the 2x and 4x levels
+# together cost 1/8 + 1/64 of each frame they are built for.
+
+PYRAMID_FACTORS = (2, 4)
+PYRAMID_AHEAD = 4 # frames past the one on screen that get levels
+PYRAMID_BYTES = 128*1024*1024
+
+
+def downsample2(frame):
+    # 2x2x2 block mean of an (x, y, z) frame, in the frame's dtype; an odd
+    # edge is padded by repeating its last voxel. uint8 frames are summed in
+    # uint16, anything else (the float dB volumes of .mat input) in float64
+    pad = [(0, s % 2) for s in frame.shape]
+    if any(after for before, after in pad):
+        frame = np.pad(frame, pad, mode='edge')
+    # pairwise sums one axis at a time are several times faster than a
+    # reshape to 2x2x2 blocks and a sum over three strided axes
+    blocks = frame[0::2].astype(np.uint16 if frame.dtype == np.uint8 else np.float64)
+    blocks += frame[1::2]
+    blocks = blocks[:, 0::2] + blocks[:, 1::2]
+    blocks = blocks[:, :, 0::2] + blocks[:, :, 1::2]
+    if frame.dtype == np.uint8:
+        blocks += 4
+        blocks >>= 3
+        return blocks.astype(np.uint8)
+    blocks /= 8
+    if np.issubdtype(frame.dtype, np.integer):
+        np.rint(blocks, out=blocks)
+    return blocks.astype(frame.dtype)
+
+
+class VolumePyramid:
+    # Levels are built on a background thread for the frame on screen and the
+    # few after it, in order, which keeps .nii.gz frame reads sequential; the
+    # rest of the study is never read for them, so lazily loaded and chunked
+    # volumes stay lazy. Built frames are kept in an LRU of at most maxBytes.
+    # Until a frame has its levels the full resolution plane is used, so the
+    # viewer never waits for the build. Only the factors some view can use at
+    # displaySize are built, so small volumes cost nothing.
+    def __init__(self, volume, displaySize, factors=PYRAMID_FACTORS, ahead=PYRAMID_AHEAD, maxBytes=PYRAMID_BYTES):
+        self.volume = volume
+        self.factors = tuple(f for f in factors if any(self.fits(axis, f, displaySize) for axis in range(3)))
+        self.built = OrderedDict() # frame -> one (x, y, z) array per factor
+        self.bytes = 0
+        self.maxBytes = maxBytes
+        # the window never holds more frames than the budget, or building it
+        # would evict its own frames
+        frameBytes = sum(int(np.prod([-(-s // f) for s in volume.shape[0:3]])) for f in self.factors) * np.dtype(volume.dtype).itemsize
+        self.window = min(ahead+1, maxBytes // frameBytes) if self.factors else 0
+        self.lock = threading.Lock() # guards built and bytes
+        self.focus = 0
+        self.stopped = False
+        self.event = threading.Event()
+        self.thread = None
+        if self.window:
+            self.thread = threading.Thread(target=self.build, daemon=True)
+            self.thread.start()
+
+    def fits(self, axis, factor, displaySize):
+        # the plane at this factor still has at least as many voxels as pixels on screen
+        dims = [s for i, s in enumerate(self.volume.shape[0:3]) if i != axis]
+        return all(d // factor >= s for d, s in zip(sorted(dims), sorted(displaySize)))
+
+    def level(self, axis, t, displaySize):
+        # Coarsest built level of frame t whose axis planes still fit
+        # displaySize, and its factor; (None, 1) means full resolution
+        with self.lock:
+            levels = self.built.get(t)
+            if levels is not None:
+                self.built.move_to_end(t)
+        if levels is not None:
+            for i in range(len(self.factors)-1, -1, -1):
+                if self.fits(axis, self.factors[i], displaySize):
+                    return levels[i], self.factors[i]
+        return None, 1
+
+    def set_focus(self, t):
+        self.focus = t
+        self.event.set()
+
+    def wake(self):
+        # frames were appended to a growing volume
+        self.event.set()
+
+    def window_frames(self):
+        # the frame on screen and the ones after it, wrapping at the end
+        numFrames = self.volume.shape[3]
+        return [(self.focus + k) % numFrames for k in range(min(self.window, numFrames))]
+
+    def next_frame(self):
+        for t in self.window_frames():
+            if t not in self.built:
+                return t
+        return None
+
+    def build(self):
+        while not self.stopped:
+            self.event.clear()
+            t = self.next_frame()
+            if t is None:
+                self.event.wait()
+                continue
+            # a lazily loaded volume reads the frame through its own cache,
+            # which the viewer and its prefetch are filling with the same frames
+            frame = np.asarray(self.volume[:, :, :, t])
+            levels = []
+            f = 1
+            for factor in self.factors:
+                while f < factor:
+                    frame = downsample2(frame)
+                    f *= 2
+                levels.append(frame)
+            with self.lock:
+                self.built[t] = levels
+                self.bytes += sum(level.nbytes for level in levels)
+                # least recently shown frames go first; the window itself fits the budget
+                window = set(self.window_frames())
+                for old in [old for old in self.built if old not in window]:
+                    if self.bytes <= self.maxBytes:
+                        break
+                    self.bytes -= sum(level.nbytes for level in self.built.pop(old))
+
+    def close(self):
+        self.stopped = True
+        self.event.set()